@@ -1,12 +1,29 @@
-from flask import Flask, render_template, request, flash
-from pyecharts import options as opts
-from pyecharts.charts import Line, Pie
-from jinja2 import Markup
+from flask import Flask, render_template, request, flash, jsonify, Response, stream_with_context, abort, g
+from jinja2 import FileSystemBytecodeCache, Markup
 import os
+import heapq
+import gzip
+import hashlib
+import io
+import csv
 import json
-import requests
+from itertools import chain
+from urllib.parse import urlencode
 from datetime import datetime, timedelta
-import statistics
+from cache import TTLCache
+import config
+import leaderboard
+import ledger
+import live
+import metrics
+import shards
+import snapshots
+import stats
+import thumbs
+from series import PriceSeries, lttb
+import store
+import transactions
+import upstream
 
 # Platform to contract
 contracts = {
@@ -41,163 +58,231 @@ class Error(Exception):
 
 # Find alias of address
 def find_alias(addr):
-    r = requests.request("GET", f"https://api.tzkt.io/v1/accounts/{addr}")
-    alias = json.loads(r.text)['alias']
-    return alias if alias != None else addr
+    return store.aliases.resolve(addr)
 
 # Give token id and contract to find token
 def find_token(token_id,contract):
 
-    r = requests.request("GET", f"https://api.akaswap.com/v2/fa2tokens/{contract}/{token_id}")
-    if r.status_code != 200:
+    reply = upstream.fetch('token', loaded=lambda token: store.aliases.harvest_tokens([token]), contract=contract, token_id=token_id)
+    if reply.status != 200:
         raise Error('Non-existent Token')
 
-    token = json.loads(r.text)    
-    return token
+    return reply.data
+
+# Collect price history of token
+def token_history(token_id,platform):
+
+    contract = contracts[platform]
+    token = find_token(token_id,contract)
+
+    # Find the minimum sale price
+    min_sale = stats.min_swap(token)
+
+    # Sync transaction records of token into local store and read sold prices back
+    store.records.sync(contract, token_id)
+    with metrics.phase('parse'):
+        price_series = PriceSeries(store.records.sales(contract, token_id))
+
+    # Keep chart points under the limit, averages are computed over every trade
+    with metrics.phase('chart'):
+        keep = lttb(price_series.timestamps, price_series.prices, config.CHART_MAX_POINTS)
+        timestamps = price_series.timestamps[keep].tolist()
+        prices = price_series.prices[keep].tolist()
+        avg_prices = price_series.running_average()[keep].tolist()
+        rolling_prices = price_series.rolling_average(config.ROLLING_WINDOW)[keep].tolist()
+
+    # Name owners by alias
+    owners = token['owners'] or {}
+    if token.get('ownerAliases'):
+        for addr, name in token['ownerAliases'].items():
+            if name and addr in owners:
+                owners[name] = owners.pop(addr)
+
+    return {
+        'token'      : token,
+        'contract'   : contract,
+        'timestamps' : timestamps,
+        'prices'     : prices,
+        'avg_prices' : avg_prices,
+        'rolling'    : rolling_prices,
+        'series'     : price_series,
+        'min_sale'   : min_sale / 1000000 if min_sale != None else None,
+        'owners'     : [list(item) for item in owners.items()],
+        'summary'    : price_series.summary()
+    }
+
+# Digest of everything drawn on the charts of a price history
+def history_digest(history):
+    content = json.dumps([history['min_sale'], history['owners']]).encode()
+    return hashlib.sha1(history['series'].digest_bytes() + content).hexdigest()
+
+# Plot price history, charting is imported on first use since only this page needs it
+def plot_price(history):
+    from pyecharts import options as opts
+    from pyecharts.charts import Line
+    chart = Line()
+    chart.add_xaxis([datetime.utcfromtimestamp(ts) + transactions.OFFSET for ts in history['timestamps']])
+    chart.add_yaxis("History Transaction Price",history['prices'],label_opts=opts.LabelOpts(is_show=False), color='rgba(255, 151, 151, 0.8)', linestyle_opts=opts.LineStyleOpts(width=3))
+    chart.add_yaxis("Time-based Average Transaction Price",history['avg_prices'],label_opts=opts.LabelOpts(is_show=False), color='rgba(255, 208, 151, 0.8)', linestyle_opts=opts.LineStyleOpts(width=1))
+    chart.add_yaxis(f"Rolling Average Transaction Price ({config.ROLLING_WINDOW} trades)",history['rolling'],label_opts=opts.LabelOpts(is_show=False), color='rgba(151, 208, 151, 0.8)', linestyle_opts=opts.LineStyleOpts(width=1))
+    chart.set_global_opts(title_opts=opts.TitleOpts(title="Price History"),xaxis_opts=opts.AxisOpts(name='Time',type_="time"),yaxis_opts=opts.AxisOpts(name='Price (xtz)'))
+    if history['min_sale'] != None:
+        chart.set_series_opts(markline_opts=opts.MarkLineOpts(data=[opts.MarkLineItem(y=history['min_sale'], name="Current Min Sale Price",type_='min')] , linestyle_opts=opts.LineStyleOpts(color='rgba(150, 226, 255, 0.8)',type_='dotted')))
+    return Markup(chart.render_embed())
+
+# Plot owner
+def plot_owner(history):
+    from pyecharts import options as opts
+    from pyecharts.charts import Pie
+    pie = Pie()
+    pie.add('', history['owners'])
+    pie.set_global_opts(title_opts=opts.TitleOpts(title="Owners"),legend_opts=opts.LegendOpts(is_show=False))
+    pie.set_series_opts(label_opts=opts.LabelOpts(is_show=False))
+    return Markup(pie.render_embed())
+
+# Rendered charts by token and digest of their content
+charts = TTLCache(config.CHART_CACHE_SIZE)
+metrics.register_cache('charts', charts)
+
+# Render charts of price history, reused until records or owners change
+def render_charts(history):
+    key = (history['contract'], history['token']['tokenId'], history_digest(history))
+    def render():
+        with metrics.phase('chart'):
+            return (
+                plot_price(history) if history['prices'] else None,
+                plot_owner(history) if history['owners'] else None
+            )
+    return charts.get_or_load(key, render, config.CHART_TTL)
 
 # Find price history of token
 def token_price_history(token_id,platform):
 
     current_time = datetime.now()
 
-    contract = contracts[platform]
-
     try:
-        token = find_token(token_id,contract)
+        history = token_history(token_id,platform)
     except Exception as e:
         flash(e.msg, 'danger')
         return
 
+    token, summary = history['token'], history['summary']
+
     # Modify display uri
     photo = token['displayUri']
     if photo == None:
         flash('Non-existent Photo', 'warning')
     else:
-        photo = photo.replace("ipfs://", "https://ipfs.io/ipfs/")
+        photo = thumbs.thumb_url(photo, 'large')
 
-    # Find the minimum sale price
-    min_sale = float('inf')
-    for sale in token['sale']['swaps']:
-        sale_xtz = sale['xtzPerToken'] / 1000000
-        min_sale = sale_xtz if sale_xtz < min_sale else min_sale
-
-    # Use contract and token id to find transaction records
-    r = requests.request("GET", f"https://akaswap.com/api/v2/fa2tokens/{contract}/{token_id}/records")
-    record_list = json.loads(r.text)['records']
-    aggr_price = 0
-    timestamps, prices, avg_prices = [], [], []
-    for record in reversed(record_list):
-        if record['type'] in ['collect_offer','collect']:
-            timestamps.append(datetime.strptime(record['timestamp'], "%Y-%m-%dT%H:%M:%SZ") + timedelta(hours=8))
-            prices.append(record['price'] / 1000000)
-            aggr_price += record['price'] / 1000000
-            avg_prices.append(round(aggr_price / len(prices),2))
-
-    # Plot price history
-    txn_num = len(prices)
-    if prices:
-        mean_price = statistics.mean(prices)
-        max_price , min_price = max(prices) , min(prices)
-        chart = Line()
-        chart.add_xaxis(timestamps)
-        chart.add_yaxis("History Transaction Price",prices,label_opts=opts.LabelOpts(is_show=False), color='rgba(255, 151, 151, 0.8)', linestyle_opts=opts.LineStyleOpts(width=3))
-        chart.add_yaxis("Time-based Average Transaction Price",avg_prices,label_opts=opts.LabelOpts(is_show=False), color='rgba(255, 208, 151, 0.8)', linestyle_opts=opts.LineStyleOpts(width=1))
-        chart.set_global_opts(title_opts=opts.TitleOpts(title="Price History"),xaxis_opts=opts.AxisOpts(name='Time',type_="time"),yaxis_opts=opts.AxisOpts(name='Price (xtz)'))
-        if min_sale != float('inf'):
-            chart.set_series_opts(markline_opts=opts.MarkLineOpts(data=[opts.MarkLineItem(y=min_sale, name="Current Min Sale Price",type_='min')] , linestyle_opts=opts.LineStyleOpts(color='rgba(150, 226, 255, 0.8)',type_='dotted')))
-        chart = Markup(chart.render_embed())
-    else:
+    if not history['prices']:
         flash('Non-existent Price History', 'warning')
+    if not history['owners']:
+        flash('Non-existent Owner', 'warning')
 
-    # Plot owner
-    owners = token['owners']
-    if owners:
-        if token.get('ownerAliases'):
-            for addr, name in token['ownerAliases'].items():
-                if name:
-                    owners[name] = owners.pop(addr)
-        pie = Pie()
-        pie.add('', [list(item) for item in owners.items()])
-        pie.set_global_opts(title_opts=opts.TitleOpts(title="Owners"),legend_opts=opts.LegendOpts(is_show=False))
-        pie.set_series_opts(label_opts=opts.LabelOpts(is_show=False))
-        pie = Markup(pie.render_embed())
+    # Plot on server unless the page draws from chart data
+    if config.CLIENT_CHARTS:
+        chart, pie = None, None
     else:
-        flash('Non-existent Owner', 'warning')
-    
+        chart, pie = render_charts(history)
+
+    # Live updates start after the newest sale on the page
+    series = history['series']
+    last_sale = int(series.timestamps[-1]) if len(series) else 0
+
     # Set token data
     token_data = {
         'Token Name' : token['name'],
         'Photo' : photo,
-        'Chart' : chart if prices else None,
-        'Pie' : pie if owners else None,
+        'Chart' : chart,
+        'Pie' : pie,
+        'Data URL' : f'/history/data?platform={platform}&token_id={token_id}' if config.CLIENT_CHARTS else None,
+        'Live URL' : f'/history/live?platform={platform}&token_id={token_id}&since={last_sale}' if config.LIVE_UPDATES else None,
         'Current Time' : current_time.strftime("%Y-%m-%d %H:%M:%S"),
         'URL' : f'https://akaswap.com/{platform}/{token_id}',
         'info' : {
             'Token ID' : token_id,
             'Amount'   : token['amount'],
-            'Total Transaction Number' : txn_num,
-            'Max Transaction Price'    : "{:.2f} xtz".format(max_price) if prices else '',
-            'Mean Transaction Price'   : "{:.2f} xtz".format(mean_price) if prices else '',
-            'Min Transaction Price'    : "{:.2f} xtz".format(min_price) if prices else '',
-            'Current Min Sale Price'   : "{:.2f} xtz".format(min_sale) if min_sale != float('inf') else ''            
+            'Total Transaction Number' : summary['count'],
+            'Max Transaction Price'    : "{:.2f} xtz".format(summary['max']) if summary['count'] else '',
+            'Mean Transaction Price'   : "{:.2f} xtz".format(summary['mean']) if summary['count'] else '',
+            'Min Transaction Price'    : "{:.2f} xtz".format(summary['min']) if summary['count'] else '',
+            'Median Transaction Price' : "{:.2f} xtz".format(summary['percentiles'][50]) if summary['count'] else '',
+            'Transaction Volume'       : "{:.2f} xtz".format(summary['volume']) if summary['count'] else '',
+            'Current Min Sale Price'   : "{:.2f} xtz".format(history['min_sale']) if history['min_sale'] != None else ''
         }
     }
 
     return token_data
 
-# Compute the respective lowest price of all tokens
-def token_lowest_price(tokens):
-    for i , token in enumerate(tokens):
-        r = requests.request("GET", f"https://akaswap.com/api/v2/fa2tokens/{token['contract']}/{token['tokenId']}/records")
-        record_list = json.loads(r.text)['records']
-        min_sale = float('inf')
-        for record in reversed(record_list):
-            if record['type'] in ['collect_offer','collect']:
-                min_sale = record['price'] if record['price'] < min_sale else min_sale
-        tokens[i]['lowestSoldPrice'] = min_sale if min_sale != float('inf') else None
-    return tokens
+# Chart data of price history
+def token_chart_data(token_id,platform):
+    history = token_history(token_id,platform)
+    return {
+        'tokenId'  : token_id,
+        'platform' : platform,
+        'name'     : history['token']['name'],
+        'digest'   : history_digest(history),
+        'series'   : {
+            'timestamps' : history['timestamps'],
+            'prices'     : history['prices'],
+            'average'    : history['avg_prices'],
+            'rolling'    : history['rolling'],
+            'window'     : config.ROLLING_WINDOW,
+            'points'     : len(history['series'])
+        },
+        'markLine' : history['min_sale'],
+        'owners'   : history['owners'],
+        'summary'  : history['summary']
+    }
 
-# Compute the respective average price of all tokens
-def token_average_price(tokens):
-    for i , token in enumerate(tokens):
-        r = requests.request("GET", f"https://akaswap.com/api/v2/fa2tokens/{token['contract']}/{token['tokenId']}/records")
-        record_list = json.loads(r.text)['records']
-        prices = []
-        for record in reversed(record_list):
-            if record['type'] in ['collect_offer','collect']:
-                prices.append(record['price'])
-        tokens[i]['averageSoldPrice'] = statistics.mean(prices) if prices else None
+# Sales of token after the last seen epoch second with the averages drawn on the chart, and the newest epoch second
+# Chart times are local without timezone, like the points plotted on the page
+def token_new_sales(contract,token_id,since):
+    series = PriceSeries(store.records.sales(contract, token_id))
+    start = int(series.timestamps.searchsorted(since, side='right'))
+    if start == len(series):
+        return [], since
+    average = series.running_average()[start:].tolist()
+    rolling = series.rolling_average(config.ROLLING_WINDOW)[start:].tolist()
+    sales = [{
+        'time'    : (datetime.utcfromtimestamp(ts) + transactions.OFFSET).isoformat(),
+        'price'   : price,
+        'average' : average[i],
+        'rolling' : rolling[i]
+    } for i , (ts, price) in enumerate(zip(series.timestamps[start:].tolist(), series.prices[start:].tolist()))]
+    return sales, int(series.timestamps[-1])
+
+# Attributes of tokens taken from record statistics
+stat_attributes = {
+    "lowestSoldPrice"  : "lowest",
+    "averageSoldPrice" : "average",
+    "medianSoldPrice"  : "median",
+    "tradeCount"       : "trades",
+    "tradeVolume"      : "volume"
+}
+
+# Compute the record statistics of all tokens
+def token_record_stats(tokens):
+    for i , token_stats in enumerate(stats.collect(tokens)):
+        for option, attr in stat_attributes.items():
+            tokens[i][option] = getattr(token_stats, attr) if token_stats else None
     return tokens
 
 # Compute the minimum sale price of all tokens
 def token_min_sale(tokens):
     for i , token in enumerate(tokens):
-        min_sale = float('inf')
-        sales = token['sale']['swaps']
-        for sale in sales:
-            sale_xtz = sale['xtzPerToken']
-            min_sale = sale_xtz if sale_xtz < min_sale else min_sale
-        tokens[i]['minSalePrice'] = min_sale if min_sale != float('inf') else None
+        tokens[i]['minSalePrice'] = stats.min_swap(token)
     return tokens
 
 # Find the collectible price of all tokens
 def token_collectible_price(tokens,addr):
 
-    token_dict = dict()
-    for token in tokens:
-        token_dict[token['contract'] + str(token['tokenId'])] = 0 
-    
-    r = requests.request("GET", f"https://api.akaswap.com/v2/accounts/{addr}/records")
-    records = json.loads(r.text)['records']
-    for record in records:
-        if record.get('contract') and token_dict.get(record['contract'] + str(record['tokenId'])) != None:
-            if record["type"][:7] == 'collect':
-                token_dict[record['contract'] + str(record['tokenId'])] += (record['amount'] * record['price'])
-            elif record["type"][:4] == 'sell':
-                token_dict[record['contract'] + str(record['tokenId'])] -= (record['amount'] * record['price'])
-
+    entries = ledger.index.entries(addr)
     for i , token in enumerate(tokens):
-        tokens[i]['collectiblePrice'] = round(token_dict[token['contract'] + str(token['tokenId'])] / token['owners'][addr],2)
+        entry = entries.get((token['contract'], token['tokenId']))
+        cost = entry.cost if entry else 0
+        tokens[i]['collectiblePrice'] = round(cost / token['owners'][addr],2)
 
     return tokens
 
@@ -207,30 +292,79 @@ def token_own_amount(tokens,addr):
         tokens[i]['ownAmount'] = tokens[i]['owners'][addr]
     return tokens    
 
-# Given option to sort token
-def token_sort(tokens,option,rev,addr):
-
-    titles = {
-        # Creation
-        "highestSoldPrice"  : "Highest Transaction Price",
-        "recentlySoldPrice" : "Recent Transaction Price",
-        "lowestSoldPrice"   : "Lowest Transaction Price",
-        "averageSoldPrice"  : "Average Transaction Price",
-        "minSalePrice"      : "Current Minimum Sale Price",
-        "amount"            : "Amount",
-        # Collection
-        "collectiblePrice"  : "Collectible Price",
-        "ownAmount"         : "Own Amount",
-        # All
-        "tokenId"           : "Token ID",
-        "name"              : "Name"
+# Select tokens of a page in ranking order and the rank of its first token
+# A heap picks the top of the ranking when the page ends well before the last token
+def select_page(tokens,rev,page,limit,key):
+    if not limit:
+        return sorted(tokens,reverse=rev,key=key), 1
+    start, end = (page - 1) * limit, page * limit
+    if start >= len(tokens):
+        return [], start + 1
+    if end <= len(tokens) // 2:
+        top = heapq.nlargest(end,tokens,key=key) if rev else heapq.nsmallest(end,tokens,key=key)
+    else:
+        top = sorted(tokens,reverse=rev,key=key)
+    return top[start:end], start + 1
+
+# Read page number and page size of ranking, a page size of 0 ranks everything on one page
+def page_args(request):
+    try:
+        page = max(int(request.values.get('page', 1)), 1)
+    except ValueError:
+        page = 1
+    try:
+        limit = max(int(request.values.get('limit', config.RANKING_PAGE_SIZE)), 0)
+    except ValueError:
+        limit = config.RANKING_PAGE_SIZE
+    return page, limit
+
+# Links to the previous and next pages of ranking
+def page_links(request,page,limit,total):
+    def url(to):
+        args = request.values.to_dict(flat=False)
+        args['page'], args['limit'] = [to], [limit]
+        return f'{request.path}?{urlencode(args, doseq=True)}'
+    pages = -(-total // limit) if limit else 1
+    return {
+        'Page'     : page,
+        'Pages'    : pages,
+        'Total'    : total,
+        'Previous' : url(page - 1) if page > 1 else None,
+        'Next'     : url(page + 1) if page < pages else None
     }
 
+# Option to title of token ranking
+token_titles = {
     # Creation
-    if option == "lowestSoldPrice":
-        tokens = token_lowest_price(tokens)
-    elif option == "averageSoldPrice":
-        tokens = token_average_price(tokens)
+    "highestSoldPrice"  : "Highest Transaction Price",
+    "recentlySoldPrice" : "Recent Transaction Price",
+    "lowestSoldPrice"   : "Lowest Transaction Price",
+    "averageSoldPrice"  : "Average Transaction Price",
+    "medianSoldPrice"   : "Median Transaction Price",
+    "tradeCount"        : "Transaction Number",
+    "tradeVolume"       : "Transaction Volume",
+    "minSalePrice"      : "Current Minimum Sale Price",
+    "amount"            : "Amount",
+    # Collection
+    "collectiblePrice"  : "Collectible Price",
+    "ownAmount"         : "Own Amount",
+    # All
+    "tokenId"           : "Token ID",
+    "name"              : "Name"
+}
+
+# Options offered on the ranking page of each user
+user_options = {
+    'creator'   : ['highestSoldPrice', 'averageSoldPrice', 'lowestSoldPrice', 'recentlySoldPrice', 'minSalePrice', 'amount', 'name', 'tokenId', 'medianSoldPrice', 'tradeCount', 'tradeVolume'],
+    'collector' : ['collectiblePrice', 'ownAmount', 'name', 'tokenId']
+}
+
+# Rank tokens by option and select a page of them
+def rank_tokens(tokens,option,rev,addr,page=1,limit=0):
+
+    # Creation
+    if option in stat_attributes:
+        tokens = token_record_stats(tokens)
     elif option == "minSalePrice":
         tokens = token_min_sale(tokens)
     # Collection
@@ -239,56 +373,58 @@ def token_sort(tokens,option,rev,addr):
     elif option == "ownAmount":
         tokens = token_own_amount(tokens,addr)
 
-    
-    tokens = sorted(tokens,reverse=(True if rev == 'reverse_True' else False), key=lambda token: token[option] if token[option] else ('' if option == 'name' else 0))
-    
+    with metrics.phase('sort'):
+        return select_page(tokens,rev == 'reverse_True',page,limit,key=lambda token: token[option] if token[option] else ('' if option == 'name' else 0))
+
+# Given option to sort token
+def token_sort(tokens,option,rev,addr,page=1,limit=0):
+
+    tokens, first_rank = rank_tokens(tokens,option,rev,addr,page,limit)
+
     ranking_data = list()
-    for i , token in enumerate(tokens):
+    for i , token in enumerate(tokens, first_rank):
         if option == "name" or option == "tokenId":
             token_option = None
-        elif option == "amount" or option == "ownAmount":
+        elif option == "amount" or option == "ownAmount" or option == "tradeCount":
             token_option = token[option] 
         else:
             token_option = "{:.2f} xtz".format(token[option] / 1000000) if token[option] != None else ''
         token_dict = {
-            'rank'     : i+1,
-            'color'    : 'rgba(255, 255, 255, 1)' if (i+1) % 2 else 'rgba(236, 236, 236, 0.8)',
+            'rank'     : i,
+            'color'    : 'rgba(255, 255, 255, 1)' if i % 2 else 'rgba(236, 236, 236, 0.8)',
             'tokenId'  : token['tokenId'],
             'name'     : token['name'],
             'platform' : platforms[token['contract']][0],
             'url'      : f"https://akaswap.com/{platforms[token['contract']][1]}/{token['tokenId']}",
-            'photo'    : token['displayUri'].replace("ipfs://", "https://ipfs.io/ipfs/") if token['displayUri'] != None else None,
+            'photo'    : thumbs.thumb_url(token['displayUri']),
             'option'   : token_option
         }
 
         ranking_data.append(token_dict)
 
-    return ranking_data , titles[option]
+    thumbs.prefetch(token['displayUri'] for token in tokens)
+    return ranking_data , token_titles[option]
 
 # Give user to find tokens
 def find_token_list(addr,user,platform):
 
     target = 'creation' if user =='creator' else 'collection'
-    tokens = []
-    for pf in platform:
-        offset = 0
-        while True:
-            r = requests.request("GET", f"https://akaswap.com/api/v2/accounts/{addr}/{target}s?limit=30&offset={offset}&contracts={contracts[pf]}")
 
-            if r.status_code == 404:
-                raise Error(f'Non-existent {user.capitalize()}')
+    # Aliases are harvested from pages fetched from upstream, pages served from cache were harvested already
+    fetched = []
 
-            count = json.loads(r.text)['count']
+    def walk(pf):
+        reply = upstream.fetch_pages('account_tokens', 'tokens', 30, params={'contracts' : contracts[pf]}, loaded=fetched.extend, addr=addr, target=target)
+        if reply.status == 404:
+            raise Error(f'Non-existent {user.capitalize()}')
+        return reply.data
 
-            if not count:
-                break
+    tokens = []
+    for platform_tokens in upstream.gather(walk, platform, strict=True):
+        tokens += platform_tokens
 
-            tokens += json.loads(r.text)['tokens']
-            offset += 30
+    store.aliases.harvest_tokens(fetched)
 
-            if offset >= count:
-                break
-            
     if not len(tokens):
         raise Error(f'Non-existent {target.capitalize()}')
 
@@ -297,23 +433,22 @@ def find_token_list(addr,user,platform):
 # Rank data winthhin user
 def rank_within_user(request,user):
     ranking_data = None
-    if request.method == 'POST':
-        addr = request.form[f'{user}_addr']
+    if request.method == 'POST' or request.args.get(f'{user}_addr'):
+        addr = request.values[f'{user}_addr']
         if not addr:
             flash(f'No {user}', 'danger')
         else:
-            try:
-                option = request.form['option']
-            except:
+            option = request.values.get('option')
+            if option not in user_options[user]:
                 flash('No Ranking Attribute', 'danger')
                 return None
             try:
-                reverse = request.form['reverse']
+                reverse = request.values['reverse']
             except:
                 flash('No Reverse Option', 'danger')
                 return None
             try:
-                platform = request.form.getlist('platform')
+                platform = request.values.getlist('platform')
             except:
                 flash('No Platform', 'danger')
                 return None
@@ -323,7 +458,13 @@ def rank_within_user(request,user):
                 flash(e.msg, 'danger')
                 return None
             
-            tokens, title = token_sort(tokens,option,reverse,addr)
+            page, limit = page_args(request)
+            total = len(tokens)
+            try:
+                tokens, title = token_sort(tokens,option,reverse,addr,page,limit)
+            except upstream.UpstreamError as e:
+                flash(e.msg, 'danger')
+                return None
 
             ranking_data = {
                 user.capitalize() : name,
@@ -331,7 +472,8 @@ def rank_within_user(request,user):
                 'Current Time'    : datetime.now().strftime("%Y-%m-%d %H:%M:%S"),
                 'tokens'          : tokens,
                 'option'          : title,
-                'Unit'            : 'Amount' if option == 'amount' or option == "ownAmount" else 'Price'
+                'Unit'            : 'Amount' if option == 'amount' or option == "ownAmount" or option == "tradeCount" else 'Price',
+                **page_links(request,page,limit,total)
             }
 
     return ranking_data
@@ -352,91 +494,95 @@ def bundle_Item_amount(tokens):
 
 # Transform time
 def transform_time(tokens,time_type):
-    for i , token in enumerate(tokens):
-        tokens[i][time_type] = datetime.strptime(token[time_type], "%Y-%m-%dT%H:%M:%SZ") + timedelta(hours=8)
+    with metrics.phase('parse'):
+        for i , token in enumerate(tokens):
+            tokens[i][time_type] = transactions.parse_time(token[time_type])
     return tokens    
 
-# Find all tokens of a specific type
+# Find all tokens of a specific type from the catalog snapshot
 def find_type_list(type,filter):
 
-    tokens, offset = [], 0
-    limit = 30 if type == 'auction' else 20
-
-    while True:
-        r = requests.request("GET", f"https://api.akaswap.com/v2/{type}s?limit={limit}&offset={offset}")
-
-        count = json.loads(r.text)['count']
+    items, age = snapshots.catalogs[type].get()
+    tokens = [dict(item) for item in items]
 
-        if not count:
-            break
-
-        tokens += json.loads(r.text)[f'{type}s']
-        offset += limit
-
-        if offset >= count:
-            break
-            
     if not len(tokens):
         raise Error(f'Non-existent {type.capitalize()}')
 
+    # Upstream timestamps have a fixed format, so they compare as strings
     if filter == 'filter_True':
-        for token in list(tokens):
-            if datetime.strptime(token['cancelTime'], "%Y-%m-%dT%H:%M:%SZ") + timedelta(hours=8) < datetime.now():
-                tokens.remove(token)
+        now = transactions.now_timestamp()
+        tokens = [token for token in tokens if token['cancelTime'] >= now]
+
+    return tokens, age
+
+# Option to title and unit of type ranking
+type_info = {
+    # Gacha
+    "gachaAmount"       : {'title' : "Amount"              , 'unit': "Amount"},
+    "gachaTotal"        : {'title' : "Total"               , 'unit': "Amount"},
+    "gachaRate"         : {'title' : "Rate"                , 'unit': "Rate"},
+    "xtzPerGacha"       : {'title' : "Price"               , 'unit': "Price"},
+    "gachaItemAmount"   : {'title' : "Item Amount"         , 'unit': "Amount"},
+    "cancelTime"        : {'title' : "Cancel Time"         , 'unit': "Time"},
+    "gachaId"           : {'title' : "Gacha ID"            , 'unit': ""},
+    # Auction
+    "auctionAmount"     : {'title' : "Amount"              , 'unit': "Amount"},
+    "startPrice"        : {'title' : "Start Price"         , 'unit': "Price"},
+    "directPrice"       : {'title' : "Direct Price"        , 'unit': "Price"},
+    "currentBidPrice"   : {'title' : "Current Bid Price"   , 'unit': "Price"},
+    "currentStorePrice" : {'title' : "Current Store Price" , 'unit': "Price"},
+    "raisePercentage"   : {'title' : "Raise Percentage"    , 'unit': "Rate"},
+    "dueTime"           : {'title' : "Due Time"            , 'unit': "Time"},
+    "auctionId"         : {'title' : "Auction ID"          , 'unit': ""},
+    # Bundle
+    "bundleAmount"      : {'title' : "Amount"              , 'unit': "Amount"},
+    "bundleTotal"       : {'title' : "Total"               , 'unit': "Amount"},
+    "bundleRate"        : {'title' : "Rate"                , 'unit': "Rate"},
+    "xtzPerBundle"      : {'title' : "Price"               , 'unit': "Price"},
+    "bundleItemAmount"  : {'title' : "Item Amount"         , 'unit': "Amount"},
+    "bundleId"          : {'title' : "Bundle ID"           , 'unit': ""},
+    # All
+    "issueTime"         : {'title' : "Issue Time"          , 'unit': "Time"},
+    "title"             : {'title' : "Title"               , 'unit': ""} 
+}
 
-    return tokens
+# Options offered on the ranking page of each type
+type_options = {
+    'gacha'   : ['gachaAmount', 'gachaTotal', 'gachaRate', 'xtzPerGacha', 'issueTime', 'cancelTime', 'title', 'gachaId'],
+    'auction' : ['startPrice', 'directPrice', 'currentBidPrice', 'currentStorePrice', 'raisePercentage', 'auctionAmount', 'issueTime', 'dueTime', 'title', 'auctionId'],
+    'bundle'  : ['bundleAmount', 'bundleTotal', 'bundleRate', 'xtzPerBundle', 'bundleItemAmount', 'issueTime', 'title', 'bundleId']
+}
 
-# Given option to sort token within a specific type
-def type_sort(tokens,option,rev,type):
-
-    info = {
-        # Gacha
-        "gachaAmount"       : {'title' : "Amount"              , 'unit': "Amount"},
-        "gachaTotal"        : {'title' : "Total"               , 'unit': "Amount"},
-        "gachaRate"         : {'title' : "Rate"                , 'unit': "Rate"},
-        "xtzPerGacha"       : {'title' : "Price"               , 'unit': "Price"},
-        "gachaItemAmount"   : {'title' : "Item Amount"         , 'unit': "Amount"},
-        "cancelTime"        : {'title' : "Cancel Time"         , 'unit': "Time"},
-        "gachaId"           : {'title' : "Gacha ID"            , 'unit': ""},
-        # Auction
-        "auctionAmount"     : {'title' : "Amount"              , 'unit': "Amount"},
-        "startPrice"        : {'title' : "Start Price"         , 'unit': "Price"},
-        "directPrice"       : {'title' : "Direct Price"        , 'unit': "Price"},
-        "currentBidPrice"   : {'title' : "Current Bid Price"   , 'unit': "Price"},
-        "currentStorePrice" : {'title' : "Current Store Price" , 'unit': "Price"},
-        "raisePercentage"   : {'title' : "Raise Percentage"    , 'unit': "Rate"},
-        "dueTime"           : {'title' : "Due Time"            , 'unit': "Time"},
-        "auctionId"         : {'title' : "Auction ID"          , 'unit': ""},
-        # Bundle
-        "bundleAmount"      : {'title' : "Amount"              , 'unit': "Amount"},
-        "bundleTotal"       : {'title' : "Total"               , 'unit': "Amount"},
-        "bundleRate"        : {'title' : "Rate"                , 'unit': "Rate"},
-        "xtzPerBundle"      : {'title' : "Price"               , 'unit': "Price"},
-        "bundleItemAmount"  : {'title' : "Item Amount"         , 'unit': "Amount"},
-        "bundleId"          : {'title' : "Bundle ID"           , 'unit': ""},
-        # All
-        "issueTime"         : {'title' : "Issue Time"          , 'unit': "Time"},
-        "title"             : {'title' : "Title"               , 'unit': ""} 
-    }
+# Rank tokens of a specific type by option and select a page of them
+def rank_type_tokens(tokens,option,rev,type,page=1,limit=0):
 
     # Bundle
     if option[-4:] == "Rate":
         tokens = compute_rate(tokens,type)
     elif option == "bundleItemAmount":
         tokens = bundle_Item_amount(tokens)
-    elif option[-4:] == "Time":
+
+    # Times are sorted as timestamp strings
+    with metrics.phase('sort'):
+        return select_page(tokens,rev == 'reverse_True',page,limit,key=lambda token: token[option] if token[option] else ('' if option == 'Title' else 0))
+
+# Given option to sort token within a specific type
+def type_sort(tokens,option,rev,type,page=1,limit=0):
+
+    tokens, first_rank = rank_type_tokens(tokens,option,rev,type,page,limit)
+    # Times are only transformed on the page
+    if option[-4:] == "Time":
         tokens = transform_time(tokens,option)
 
-    tokens = sorted(tokens,reverse=(True if rev == 'reverse_True' else False), key=lambda token: token[option] if token[option] else ('' if option == 'Title' else 0))
-    
     ranking_data = list()
-    for i , token in enumerate(tokens):
-        if info[option]['unit'] == "":
+    uris = list()
+    for i , token in enumerate(tokens, first_rank):
+        if type_info[option]['unit'] == "":
             token_option = None
-        elif info[option]['unit'] == "Price":
+        elif type_info[option]['unit'] == "Price":
             token_option = "{:.2f} xtz".format(token[option] / 1000000) if token[option] != None else ''
-        elif info[option]['unit'] == "Time":
-            token_option = token[option].strftime("%Y-%m-%d %H:%M:%S")
+        elif type_info[option]['unit'] == "Time":
+            token_option = transactions.display_time(token[option])
         else:
             token_option = token[option] 
 
@@ -450,122 +596,306 @@ def type_sort(tokens,option,rev,type):
         object_item = token if type == "auction" else token[f"{type}Items"][0]
 
         token_dict = {
-            'rank'   : i+1,
-            'color'  : 'rgba(255, 255, 255, 1)' if (i+1) % 2 else 'rgba(236, 236, 236, 0.8)',
+            'rank'   : i,
+            'color'  : 'rgba(255, 255, 255, 1)' if i % 2 else 'rgba(236, 236, 236, 0.8)',
             'Id'     : token[f'{type}Id'],
             'name'   : token['title'],
             'url'    : f"https://akaswap.com/{type}/{version}{token[f'{type}Id']}",
-            'photo'  : object_item['token'].get('displayUri').replace("ipfs://", "https://ipfs.io/ipfs/") if object_item['token']['displayUri'] != None else None,
+            'photo'  : thumbs.thumb_url(object_item['token'].get('displayUri')),
             'option' : token_option
         }
 
         ranking_data.append(token_dict)
+        uris.append(object_item['token'].get('displayUri'))
 
-    return ranking_data , info[option]['title'], info[option]['unit']
+    thumbs.prefetch(uris)
+    return ranking_data , type_info[option]['title'], type_info[option]['unit']
 
 # Rank all data of a sepcific type
 def rank_within_type(request,type):
     ranking_data = None
     filter = False
-    if request.method == 'POST':
-        try:
-            option = request.form['option']
-        except:
+    if request.method == 'POST' or request.args.get('option'):
+        option = request.values.get('option')
+        if option not in type_options[type]:
             flash('No Ranking Attribute', 'danger')
             return None
         if type == 'gacha':
             try:
-                filter = request.form['filter']
+                filter = request.values['filter']
             except:
                 flash('No Filter Option', 'danger')
                 return None
         try:
-            reverse = request.form['reverse']
+            reverse = request.values['reverse']
         except:
             flash('No Reverse Option', 'danger')
             return None
         try:
-            tokens = find_type_list(type,filter)
+            tokens, age = find_type_list(type,filter)
         except Exception as e:
             flash(e.msg, 'danger')
             return None
             
-        tokens, title, unit = type_sort(tokens,option,reverse,type)
+        page, limit = page_args(request)
+        total = len(tokens)
+        tokens, title, unit = type_sort(tokens,option,reverse,type,page,limit)
 
         ranking_data = {
             'Current Time'    : datetime.now().strftime("%Y-%m-%d %H:%M:%S"),
+            'Snapshot Age'    : int(age),
             'tokens'          : tokens,
             'option'          : title,
-            'Unit'            : unit
+            'Unit'            : unit,
+            **page_links(request,page,limit,total)
         }
 
     return ranking_data
 
-# Filter thansaction record
-def transaction_record(user_addr,platform,type,action,start_time,end_time):
+# Sales volume of tokens and creators across platforms, ingested in background
+volumes = leaderboard.VolumeIndex(config.RECORD_STORE_PATH, set(platforms), config.LEADERBOARD_INTERVAL)
 
-    start_time = (datetime.strptime(start_time,"%Y-%m-%d") - timedelta(hours=8)).strftime("%Y-%m-%dT%H:%M:%SZ")
-    end_time = (datetime.strptime(end_time,"%Y-%m-%d") - timedelta(hours=8) + timedelta(days=1)).strftime("%Y-%m-%dT%H:%M:%SZ")
+# Option to title of volume ranking
+volume_titles = {
+    'volume' : 'Sales Volume',
+    'trades' : 'Transaction Number'
+}
 
-    actions = []
-    for t in type:
-        actions += types[t]
-
-    for a in list(actions):
-        if a.split('_')[0] not in action and not(a == 'cancel_swap' and 'swap' in action):
-            actions.remove(a)
-
-    record_data = []
-
-    r = requests.request("GET", f"https://api.akaswap.com/v2/accounts/{user_addr}/records?startTime={start_time}&endTime={end_time}")
-    records = json.loads(r.text)['records']
-    for record in records:
-        if (len(platform) == 5 or (record.get("contract") and platforms[record['contract']][1] in platform)) and record["type"] in actions: 
-            new_record = {
-                'color'     : 'rgba(236, 236, 236, 0.8)' if len(record_data) % 2 else 'rgba(255, 255, 255, 1)',
-                'time'      : datetime.strptime(record['timestamp'], "%Y-%m-%dT%H:%M:%SZ") + timedelta(hours=8),
-                'platform'  : platforms[record["contract"]][0] if record.get("contract") else '',
-                'from'      : record["fromAlias"] if record.get("fromAlias") else (f'{record["from"][:3]}...{record["from"][-3:]}' if record["from"] else ''),
-                'from_url'  : f'https://akaswap.com/tz/{record["from"]}' if record["from"] else 'https://akaswap.com/',
-                'to'        : record["toAlias"] if record.get("toAlias") else (f'{record["to"][:3]}...{record["to"][-3:]}' if record["to"] else ''),
-                'to_url'    : f'https://akaswap.com/tz/{record["to"]}' if record["to"] else 'https://akaswap.com/',
-                'token'     : record["tokenName"],
-                'token_url' : f"https://akaswap.com/{platforms[record['contract']][1]}/{record['tokenId']}" if record.get("contract") else 'https://akaswap.com/',
-                'auction'   : record["type"].replace('_',' '),
-                'amount'    : record["amount"],
-                'price'     : "{:.2f} xtz".format(record["price"] / 1000000) if record["price"] != None else ''
+# Window to title of volume ranking
+window_titles = {
+    '24h' : 'Last 24 Hours',
+    '7d'  : 'Last 7 Days',
+    'all' : 'Since Indexing'
+}
+
+# Title of a volume window, the all-time window only counts from the day the index started from
+def window_title(window):
+    if window == 'all' and volumes.since:
+        return f'Since {volumes.since[:10]}'
+    return window_titles[window]
+
+# Page of a volume leaderboard, sliced from the ranked entries kept in memory
+def volume_page(kind,window,option,page=1,limit=0):
+    entries, total, age = volumes.get(window, kind, option)
+    first = (page - 1) * limit if limit else 0
+    return entries[first:first + limit] if limit else entries, first + 1, len(entries), total, age
+
+# Rank tokens or creators by sales volume
+def rank_volume(request):
+    ranking_data = None
+    if request.method == 'POST' or request.args.get('option'):
+        kind, window, option = request.values.get('kind'), request.values.get('window'), request.values.get('option')
+        if kind not in leaderboard.KINDS:
+            flash('No Ranking Target', 'danger')
+            return None
+        if window not in window_titles:
+            flash('No Time Window', 'danger')
+            return None
+        if option not in volume_titles:
+            flash('No Ranking Attribute', 'danger')
+            return None
+
+        page, limit = page_args(request)
+        entries, first_rank, ranked, total, age = volume_page(kind,window,option,page,limit)
+        if not ranked:
+            flash('No Sale' if volumes.synced else 'Sales Are Being Indexed', 'warning')
+
+        tokens = list()
+        for i , entry in enumerate(entries, first_rank):
+            token_dict = {
+                'rank'   : i,
+                'color'  : 'rgba(255, 255, 255, 1)' if i % 2 else 'rgba(236, 236, 236, 0.8)',
+                'volume' : "{:.2f} xtz".format(entry['volume'] / 1000000),
+                'trades' : entry['trades'],
+                'last'   : "{:.2f} xtz".format(entry['lastPrice'] / 1000000) if entry['lastPrice'] != None else ''
             }
-            record_data.append(new_record)
-        continue
+            if kind == 'token':
+                token_dict.update({
+                    'name'     : entry['name'],
+                    'url'      : f"https://akaswap.com/{platforms[entry['contract']][1]}/{entry['tokenId']}",
+                    'platform' : platforms[entry['contract']][0],
+                    'photo'    : thumbs.thumb_url(entry['displayUri'])
+                })
+            else:
+                token_dict.update({
+                    'name' : entry['alias'] if entry['alias'] != entry['creator'] else short_addr(entry['creator']),
+                    'url'  : f"https://akaswap.com/tz/{entry['creator']}"
+                })
+            tokens.append(token_dict)
+        thumbs.prefetch(entry.get('displayUri') for entry in entries)
+
+        ranking_data = {
+            'Current Time'  : datetime.now().strftime("%Y-%m-%d %H:%M:%S"),
+            'Snapshot Age'  : int(age),
+            'Kind'          : kind,
+            'tokens'        : tokens,
+            'option'        : f'{volume_titles[option]} ({window_title(window)})',
+            'Ranked'        : total,
+            **page_links(request,page,limit,ranked)
+        }
+
+    return ranking_data
+
+# Transaction records of user from start to end date, fetched and cached by day
+def iter_account_records(user_addr,start_time,end_time):
+    return shards.iter_records(user_addr,start_time,end_time)
+
+# Check of raw records against selected platforms, types and actions
+def record_filter(platform,type,action):
+
+    actions = set()
+    for t in type:
+        for a in types[t]:
+            if a.split('_')[0] in action or (a == 'cancel_swap' and 'swap' in action):
+                actions.add(a)
+
+    all_platforms = len(platform) == len(contracts)
+    selected = {contracts[pf] for pf in platform}
 
-    return record_data
+    return lambda record: (all_platforms or record.get("contract") in selected) and record["type"] in actions
+
+# Filter thansaction record
+def filter_record(user_addr,platform,type,action,start_time,end_time):
+    keep = record_filter(platform,type,action)
+    # Only records kept by the filter are decoded
+    for record in iter_account_records(user_addr,start_time,end_time):
+        if keep(record):
+            yield transactions.decode(record)
+
+# Shortened address for display
+def short_addr(addr):
+    return f'{addr[:3]}...{addr[-3:]}' if addr else ''
+
+# Record type to displayed action
+action_labels = {a : a.replace('_',' ') for actions in types.values() for a in actions}
+
+# Format transaction record for display
+def record_row(record):
+    return {
+        'timestamp' : record.timestamp,
+        'time'      : transactions.display_time(record.time),
+        'platform'  : platforms[record.contract][0] if record.contract else '',
+        'from'      : record.sender_alias or short_addr(record.sender),
+        'from_url'  : f'https://akaswap.com/tz/{record.sender}' if record.sender else 'https://akaswap.com/',
+        'to'        : record.receiver_alias or short_addr(record.receiver),
+        'to_url'    : f'https://akaswap.com/tz/{record.receiver}' if record.receiver else 'https://akaswap.com/',
+        'token'     : record.token_name,
+        'token_url' : f"https://akaswap.com/{platforms[record.contract][1]}/{record.token_id}" if record.contract else 'https://akaswap.com/',
+        'auction'   : action_labels[record.type],
+        'amount'    : record.amount,
+        'price'     : "{:.2f} xtz".format(record.price / 1000000) if record.price != None else ''
+    }
+
+# Format transaction records for display
+def transaction_record(user_addr,platform,type,action,start_time,end_time):
+    for i , record in enumerate(filter_record(user_addr,platform,type,action,start_time,end_time)):
+        yield {'color' : 'rgba(236, 236, 236, 0.8)' if i % 2 else 'rgba(255, 255, 255, 1)', **record_row(record)}
+
+# Transaction records of user after the last seen timestamp formatted for display, oldest first, and the newest timestamp
+def new_transaction_record(user_addr,platform,type,action,since):
+    keep = record_filter(platform,type,action)
+    rows = []
+    # Records come newest first, so the last seen one ends the new ones
+    for record in iter_account_records(user_addr,transactions.parse_time(since).date().isoformat(),transactions.today()):
+        if record['timestamp'] <= since:
+            break
+        if keep(record):
+            rows.append(record_row(transactions.decode(record)))
+    return rows[::-1], rows[0]['timestamp'] if rows else since
+
+# Transaction records as plain rows for export
+def export_record(user_addr,platform,type,action,start_time,end_time):
+    for record in filter_record(user_addr,platform,type,action,start_time,end_time):
+        yield {
+            'timestamp' : record.timestamp,
+            'platform'  : platforms[record.contract][0] if record.contract else '',
+            'contract'  : record.contract,
+            'tokenId'   : record.token_id,
+            'token'     : record.token_name,
+            'type'      : record.type,
+            'from'      : record.sender,
+            'to'        : record.receiver,
+            'amount'    : record.amount,
+            'price'     : record.price
+        }
+
+# Rows until upstream fails, a page already being sent ends its table there instead of breaking off
+def until_upstream_error(rows):
+    try:
+        yield from rows
+    except upstream.UpstreamError as e:
+        app.logger.warning('Streamed page stopped early: %s', e.msg)
+
+# Render template as a timed phase of the request
+def render_page(template_name, **context):
+    with metrics.phase('template'):
+        return render_template(template_name, **context)
+
+# Render template chunk by chunk
+def stream_template(template_name, **context):
+    app.update_template_context(context)
+    return app.jinja_env.get_template(template_name).generate(context)
+
+# Write rows as csv lines
+def csv_lines(rows):
+    buffer = io.StringIO()
+    writer = None
+    for row in rows:
+        if writer is None:
+            writer = csv.DictWriter(buffer, fieldnames=list(row))
+            writer.writeheader()
+        writer.writerow(row)
+        yield buffer.getvalue()
+        buffer.seek(0)
+        buffer.truncate()
 
 app = Flask(__name__)
 
+# Time every request by route, the response is recorded once fully sent
+@app.before_request
+def start_timer():
+    g.trace = metrics.start_request(request.url_rule.rule if request.url_rule else 'unmatched')
+
+# Event streams stay open for minutes, so only their setup is timed
+@app.after_request
+def stop_timer(response):
+    trace = g.pop('trace', None)
+    if trace is not None:
+        status = response.status_code
+        if response.mimetype == 'text/event-stream':
+            metrics.finish_request(trace, status)
+        else:
+            response.call_on_close(lambda: metrics.finish_request(trace, status))
+    return response
+
 @app.route("/ranking/creation", methods=['GET', 'POST'])
 def ranking_creation():
-    return render_template("ranking_creation.html",data=rank_within_user(request,'creator'))
+    return render_page("ranking_creation.html",data=rank_within_user(request,'creator'))
 
 @app.route("/ranking/collection", methods=['GET', 'POST'])
 def ranking_collection():
-    return render_template("ranking_collection.html",data=rank_within_user(request,'collector'))
+    return render_page("ranking_collection.html",data=rank_within_user(request,'collector'))
 
 @app.route("/ranking/gacha", methods=['GET', 'POST'])
 def ranking_gacha():
-    return render_template("ranking_gacha.html",data=rank_within_type(request,'gacha'))
+    return render_page("ranking_gacha.html",data=rank_within_type(request,'gacha'))
 
 @app.route("/ranking/auction", methods=['GET', 'POST'])
 def ranking_auction():
-    return render_template("ranking_auction.html",data=rank_within_type(request,'auction'))
+    return render_page("ranking_auction.html",data=rank_within_type(request,'auction'))
 
 @app.route("/ranking/bundle", methods=['GET', 'POST'])
 def ranking_bundle():
-    return render_template("ranking_bundle.html",data=rank_within_type(request,'bundle'))
+    return render_page("ranking_bundle.html",data=rank_within_type(request,'bundle'))
 
+@app.route("/ranking/volume", methods=['GET', 'POST'])
+def ranking_volume():
+    data = rank_volume(request)
+    return render_page("ranking_volume.html",data=data,all_title=window_title('all'))
 
 @app.route("/ranking", methods=['GET'])
 def ranking():
-    return render_template("ranking.html")
+    return render_page("ranking.html")
 
 @app.route("/history", methods=['GET', 'POST'])
 def history():
@@ -579,14 +909,58 @@ def history():
                 platform = request.form['platform']
             except:
                 flash('No Platform', 'danger')
-                return render_template("history.html",data=token_data)
+                return render_page("history.html",data=token_data)
             try:
                 token_id = int(token_id)
             except:
                 flash('Invalid Token ID', 'danger')
-                return render_template("history.html",data=token_data)
+                return render_page("history.html",data=token_data)
             token_data = token_price_history(token_id,platform)
-    return render_template("history.html",data=token_data)
+    return render_page("history.html",data=token_data)
+
+@app.route("/history/data", methods=['GET'])
+def history_data():
+    platform = request.args.get('platform')
+    try:
+        token_id = int(request.args.get('token_id'))
+    except (TypeError, ValueError):
+        abort(400)
+    if platform not in contracts:
+        abort(400)
+    try:
+        chart_data = token_chart_data(token_id,platform)
+    except Error:
+        abort(404)
+    except upstream.UpstreamError:
+        abort(502)
+    response = jsonify(chart_data)
+    response.cache_control.public = True
+    response.cache_control.max_age = config.CHART_DATA_MAX_AGE
+    return response
+
+# Stream of server-sent events, routes start it from the last event id a reconnecting browser sends
+def live_response(page, key, poll, read, since):
+    return Response(stream_with_context(live.events(page, key, poll, read, since)), mimetype='text/event-stream', headers={'Cache-Control' : 'no-cache', 'X-Accel-Buffering' : 'no'})
+
+@app.route("/history/live", methods=['GET'])
+def history_live():
+    platform = request.args.get('platform')
+    try:
+        token_id = int(request.args.get('token_id'))
+        since = int(request.headers.get('Last-Event-ID') or request.args.get('since', 0))
+    except (TypeError, ValueError):
+        abort(400)
+    if not config.LIVE_UPDATES:
+        abort(404)
+    if platform not in contracts:
+        abort(400)
+    contract = contracts[platform]
+    return live_response(
+        'history', f'history/{contract}/{token_id}',
+        lambda: store.records.sync(contract, token_id, cached=False),
+        lambda since: token_new_sales(contract, token_id, since),
+        since
+    )
 
 @app.route("/record", methods=['GET', 'POST'])
 def record():
@@ -607,36 +981,292 @@ def record():
                 platform = request.form.getlist('platform')
             except:
                 flash('No Platform', 'danger')
-                return render_template("record.html",data=record_data)
+                return render_page("record.html",data=record_data)
             try:
                 type = request.form.getlist('type')
             except:
                 flash('No Type', 'danger')
-                return render_template("record.html",data=record_data)
+                return render_page("record.html",data=record_data)
             try:
                 action = request.form.getlist('action')
             except:
                 flash('No Action', 'danger')
-                return render_template("record.html",data=record_data)
+                return render_page("record.html",data=record_data)
             records = transaction_record(user_addr,platform,type,action,start_time,end_time)
-            if not records:
+            try:
+                first = next(records, None)
+            except upstream.UpstreamError as e:
+                flash(e.msg, 'danger')
+                return render_page("record.html",data=record_data)
+            if not first:
                 flash('No Record', 'danger')
             else:
+                query = urlencode({'user_addr' : user_addr, 'start_time' : start_time, 'end_time' : end_time, 'platform' : platform, 'type' : type, 'action' : action}, doseq=True)
                 record_data = {
                     'User'         : find_alias(user_addr),
                     'URL'          : f'https://akaswap.com/tz/{user_addr}',
                     'Current Time' : datetime.now().strftime("%Y-%m-%d %H:%M:%S"),
                     'Start Time'   : start_time,
                     'End Time'     : end_time,
-                    'Records'      : records
+                    'Records'      : until_upstream_error(chain([first], records)),
+                    'CSV'          : f'/record/export?format=csv&{query}',
+                    'NDJSON'       : f'/record/export?format=ndjson&{query}',
+                    # Only ranges reaching today get new records
+                    'Live URL'     : f'/record/live?{query}&since={first["timestamp"]}' if config.LIVE_UPDATES and end_time >= transactions.today() else None
                 }
-    return render_template("record.html",data=record_data)
+                return Response(stream_with_context(stream_template("record.html",data=record_data)))
+    return render_page("record.html",data=record_data)
+
+@app.route("/record/export", methods=['GET'])
+def record_export():
+    user_addr, start_time, end_time = request.args.get('user_addr'), request.args.get('start_time'), request.args.get('end_time')
+    if not user_addr or not start_time or not end_time:
+        abort(400)
+    # Checked before the response starts, an error while streaming would cut the download short
+    platform, type, action = request.args.getlist('platform'), request.args.getlist('type'), request.args.getlist('action')
+    if any(pf not in contracts for pf in platform) or any(t not in types for t in type):
+        abort(400)
+    try:
+        datetime.strptime(start_time, "%Y-%m-%d")
+        datetime.strptime(end_time, "%Y-%m-%d")
+    except ValueError:
+        abort(400)
+    fmt = request.args.get('format', 'csv')
+    rows = export_record(user_addr,platform,type,action,start_time,end_time)
+
+    if fmt == 'ndjson':
+        body, mimetype = (json.dumps(row) + '\n' for row in rows), 'application/x-ndjson'
+    elif fmt == 'csv':
+        body, mimetype = csv_lines(rows), 'text/csv'
+    else:
+        abort(400)
+
+    filename = f'{user_addr}_{start_time}_{end_time}.{fmt}'
+    return Response(stream_with_context(body), mimetype=mimetype, headers={'Content-Disposition' : f'attachment; filename={filename}'})
+
+@app.route("/record/live", methods=['GET'])
+def record_live():
+    user_addr, since = request.args.get('user_addr'), request.headers.get('Last-Event-ID') or request.args.get('since')
+    platform, type, action = request.args.getlist('platform'), request.args.getlist('type'), request.args.getlist('action')
+    if not config.LIVE_UPDATES:
+        abort(404)
+    if not user_addr or not since or any(pf not in contracts for pf in platform) or any(t not in types for t in type):
+        abort(400)
+    try:
+        transactions.parse_time(since)
+    except ValueError:
+        abort(400)
+    return live_response(
+        'record', f'record/{user_addr}',
+        lambda: shards.refresh(user_addr),
+        lambda since: new_transaction_record(user_addr,platform,type,action,since),
+        since
+    )
+
+# JSON response with a strong etag of its body, gzipped when the client accepts it
+def api_response(payload, status=200):
+    body = json.dumps(payload, sort_keys=True, separators=(',', ':')).encode()
+    gzipped = request.accept_encodings['gzip'] and len(body) >= config.GZIP_MIN_SIZE
+    etag = hashlib.sha1(body).hexdigest() + ('-gzip' if gzipped else '')
+    headers = {'ETag' : f'"{etag}"', 'Vary' : 'Accept-Encoding', 'Cache-Control' : 'no-cache'}
+
+    if status == 200 and request.if_none_match.contains(etag):
+        return Response(status=304, headers=headers)
+
+    if gzipped:
+        body = gzip.compress(body, compresslevel=config.GZIP_LEVEL)
+        headers['Content-Encoding'] = 'gzip'
+    return Response(body, status=status, mimetype='application/json', headers=headers)
+
+def api_error(msg, status):
+    return api_response({'error' : msg}, status)
+
+# Read reverse option of api request
+def api_reverse(request):
+    return 'reverse_True' if request.args.get('reverse', '').lower() in ['1', 'true', 'reverse_true'] else 'reverse_False'
+
+@app.route("/api/ranking/<any(creator, collector):user>", methods=['GET'])
+def api_ranking_user(user):
+    addr, option = request.args.get('addr'), request.args.get('option')
+    platform = request.args.getlist('platform') or list(contracts)
+    if not addr:
+        return api_error(f'No {user}', 400)
+    if option not in user_options[user]:
+        return api_error('Invalid Ranking Attribute', 400)
+    if any(pf not in contracts for pf in platform):
+        return api_error('Invalid Platform', 400)
+
+    try:
+        tokens , name = find_token_list(addr,user,platform)
+    except Error as e:
+        return api_error(e.msg, 404)
+    except upstream.UpstreamError as e:
+        return api_error(e.msg, 502)
+
+    page, limit = page_args(request)
+    total = len(tokens)
+    try:
+        tokens, first_rank = rank_tokens(tokens,option,api_reverse(request),addr,page,limit)
+    except upstream.UpstreamError as e:
+        return api_error(e.msg, 502)
+
+    return api_response({
+        user       : addr,
+        'alias'    : name,
+        'option'   : option,
+        'page'     : page,
+        'limit'    : limit,
+        'total'    : total,
+        'tokens'   : [{
+            'rank'       : i,
+            'contract'   : token['contract'],
+            'tokenId'    : token['tokenId'],
+            'name'       : token['name'],
+            'platform'   : platforms[token['contract']][1],
+            'displayUri' : token['displayUri'],
+            'value'      : token.get(option)
+        } for i , token in enumerate(tokens, first_rank)]
+    })
+
+@app.route("/api/ranking/<any(gacha, auction, bundle):type>", methods=['GET'])
+def api_ranking_type(type):
+    option = request.args.get('option')
+    if option not in type_options[type]:
+        return api_error('Invalid Ranking Attribute', 400)
+    filter = 'filter_True' if request.args.get('filter', '').lower() in ['1', 'true', 'filter_true'] else 'filter_False'
+
+    try:
+        tokens, age = find_type_list(type,filter)
+    except Error as e:
+        return api_error(e.msg, 404)
+    except upstream.UpstreamError as e:
+        return api_error(e.msg, 502)
+
+    page, limit = page_args(request)
+    total = len(tokens)
+    tokens, first_rank = rank_type_tokens(tokens,option,api_reverse(request),type,page,limit)
+
+    return api_response({
+        'type'    : type,
+        'option'  : option,
+        'page'    : page,
+        'limit'   : limit,
+        'total'   : total,
+        'items'   : [{
+            'rank'     : i,
+            'id'       : token[f'{type}Id'],
+            'contract' : token['contract'],
+            'title'    : token['title'],
+            'value'    : token.get(option)
+        } for i , token in enumerate(tokens, first_rank)]
+    })
+
+@app.route("/api/ranking/volume", methods=['GET'])
+def api_ranking_volume():
+    kind, window, option = request.args.get('kind', 'token'), request.args.get('window', '24h'), request.args.get('option', 'volume')
+    if kind not in leaderboard.KINDS or window not in window_titles or option not in volume_titles:
+        return api_error('Invalid Ranking Attribute', 400)
+
+    page, limit = page_args(request)
+    entries, first_rank, ranked, total, age = volume_page(kind,window,option,page,limit)
+
+    return api_response({
+        'kind'    : kind,
+        'window'  : window,
+        'option'  : option,
+        'page'    : page,
+        'limit'   : limit,
+        'total'   : total,
+        'ranked'  : ranked,
+        'since'   : volumes.since,
+        'entries' : [{'rank' : i, **entry} for i , entry in enumerate(entries, first_rank)]
+    })
+
+@app.route("/api/history", methods=['GET'])
+def api_history():
+    platform = request.args.get('platform')
+    try:
+        token_id = int(request.args.get('token_id'))
+    except (TypeError, ValueError):
+        return api_error('Invalid Token ID', 400)
+    if platform not in contracts:
+        return api_error('Invalid Platform', 400)
+
+    try:
+        return api_response(token_chart_data(token_id,platform))
+    except Error as e:
+        return api_error(e.msg, 404)
+    except upstream.UpstreamError as e:
+        return api_error(e.msg, 502)
+
+@app.route("/api/record", methods=['GET'])
+def api_record():
+    user_addr, start_time, end_time = request.args.get('addr'), request.args.get('start_time'), request.args.get('end_time')
+    if not user_addr or not start_time or not end_time:
+        return api_error('No User or Time', 400)
+    platform = request.args.getlist('platform') or list(contracts)
+    type = request.args.getlist('type') or list(types)
+    action = request.args.getlist('action') or ['mint','burn','swap','transfer','make','sell','collect']
+    if any(pf not in contracts for pf in platform) or any(t not in types for t in type):
+        return api_error('Invalid Platform or Type', 400)
+
+    try:
+        records = list(export_record(user_addr,platform,type,action,start_time,end_time))
+    except ValueError:
+        return api_error('Invalid Time', 400)
+    except upstream.UpstreamError as e:
+        return api_error(e.msg, 502)
+
+    return api_response({
+        'user'      : user_addr,
+        'startTime' : start_time,
+        'endTime'   : end_time,
+        'records'   : records
+    })
+
+@app.route("/stats/cache")
+def cache_stats():
+    return jsonify(upstream.responses.stats())
+
+@app.route("/metrics")
+def metrics_endpoint():
+    return Response(metrics.render(), mimetype='text/plain; version=0.0.4')
+
+# Thumbnail of an ipfs image, cached for good by browsers since a cid never changes
+@app.route("/thumb/<path:cid>")
+def thumbnail(cid):
+    size = request.args.get('size', 'small')
+    if not thumbs.CID_PATTERN.match(cid) or size not in thumbs.sizes:
+        abort(404)
+    key = thumbs.cache.key(cid, thumbs.sizes[size])
+    headers = {'ETag' : f'"{key}"', 'Cache-Control' : 'public, max-age=31536000, immutable'}
+    if request.if_none_match.contains(key):
+        return Response(status=304, headers=headers)
+    try:
+        data, content_type = thumbs.thumbnail(cid, thumbs.sizes[size])
+    except thumbs.ThumbError:
+        # Left to the gateway, without caching, so a later request tries again
+        return Response(status=302, headers={'Location' : thumbs.gateway_url(cid), 'Cache-Control' : 'no-cache'})
+    return Response(data, mimetype=content_type, headers=headers)
 
 @app.route("/")
 def home():
-    return render_template("home.html")
+    return render_page("home.html")
+
+# Compile every template once, so no request pays for it
+def warm_templates():
+    for name in app.jinja_env.list_templates():
+        app.jinja_env.get_template(name)
+
+# Configure the app for serving, importing it under a preloading server shares the compiled templates with every worker
+def create_app():
+    # Sessions signed with a random key only work within one process
+    app.secret_key = config.SECRET_KEY or os.urandom(64)
+    if config.TEMPLATE_CACHE_DIR:
+        os.makedirs(config.TEMPLATE_CACHE_DIR, exist_ok=True)
+        app.jinja_env.bytecode_cache = FileSystemBytecodeCache(config.TEMPLATE_CACHE_DIR)
+    warm_templates()
+    return app
 
 if __name__ == '__main__':
-    app.debug = True
-    app.secret_key = os.urandom(64)
-    app.run()
\ No newline at end of file
+    create_app().run(debug=config.DEBUG)
\ No newline at end of file
@@ -0,0 +1,85 @@
+from datetime import datetime, timedelta, timezone
+import argparse
+import os
+import sys
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+from stub import Dataset
+import transactions
+
+# Record formatting as it was before records were decoded into compact records
+def legacy_transaction_record(records, platforms, selected, actions):
+    kept = []
+    for record in records:
+        if record.get("contract") in selected and record["type"] in actions:
+            kept.append(record)
+    for i , record in enumerate(kept):
+        yield {
+            'color'     : 'rgba(236, 236, 236, 0.8)' if i % 2 else 'rgba(255, 255, 255, 1)',
+            'time'      : datetime.strptime(record['timestamp'], "%Y-%m-%dT%H:%M:%SZ") + timedelta(hours=8),
+            'platform'  : platforms[record["contract"]][0] if record.get("contract") else '',
+            'from'      : record["fromAlias"] if record.get("fromAlias") else (f'{record["from"][:3]}...{record["from"][-3:]}' if record["from"] else ''),
+            'from_url'  : f'https://akaswap.com/tz/{record["from"]}' if record["from"] else 'https://akaswap.com/',
+            'to'        : record["toAlias"] if record.get("toAlias") else (f'{record["to"][:3]}...{record["to"][-3:]}' if record["to"] else ''),
+            'to_url'    : f'https://akaswap.com/tz/{record["to"]}' if record["to"] else 'https://akaswap.com/',
+            'token'     : record["tokenName"],
+            'token_url' : f"https://akaswap.com/{platforms[record['contract']][1]}/{record['tokenId']}" if record.get("contract") else 'https://akaswap.com/',
+            'auction'   : record["type"].replace('_',' '),
+            'amount'    : record["amount"],
+            'price'     : "{:.2f} xtz".format(record["price"] / 1000000) if record["price"] != None else ''
+        }
+
+def legacy_epoch(timestamp):
+    return int(datetime.strptime(timestamp, "%Y-%m-%dT%H:%M:%SZ").replace(tzinfo=timezone.utc).timestamp())
+
+# Seconds per item of fn over items, best of repeats
+def per_item(fn, items, repeat):
+    best = None
+    for _ in range(repeat):
+        start = time.perf_counter()
+        fn(items)
+        elapsed = time.perf_counter() - start
+        best = elapsed if best is None else min(best, elapsed)
+    return best / len(items)
+
+def compare(name, legacy, current, items, repeat):
+    before, after = per_item(legacy, items, repeat), per_item(current, items, repeat)
+    print(f'{name:<24} {before * 1e6:>9.2f} {after * 1e6:>9.2f} {before / after:>7.1f}x')
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Per-record cost of record parsing and formatting')
+    parser.add_argument('--records', type=int, default=100000)
+    parser.add_argument('--repeat', type=int, default=3)
+    args = parser.parse_args()
+
+    os.environ.setdefault('RECORD_STORE_PATH', ':memory:')
+    import app
+
+    dataset = Dataset(args.records)
+    records = [dataset.record(i, dataset.now - i * dataset.step) for i in range(args.records)]
+    timestamps = [record['timestamp'] for record in records]
+    platform, type, action = list(app.contracts), list(app.types), ['mint','burn','swap','transfer','make','sell','collect']
+    selected = {app.contracts[pf] for pf in platform}
+    actions = {a for t in type for a in app.types[t]}
+
+    def current(items):
+        app.iter_account_records = lambda user_addr, start_time, end_time: iter(items)
+        for row in app.transaction_record('tz1', platform, type, action, '2021-01-01', '2021-01-02'):
+            pass
+
+    def legacy(items):
+        for row in legacy_transaction_record(items, app.platforms, selected, actions):
+            pass
+
+    print(f'{len(records)} records, microseconds per record')
+    print(f"{'':<24} {'before':>9} {'after':>9} {'speedup':>8}")
+    compare('parse local time', lambda items: [datetime.strptime(t, "%Y-%m-%dT%H:%M:%SZ") + timedelta(hours=8) for t in items], lambda items: [transactions.parse_time(t) for t in items], timestamps, args.repeat)
+    compare('epoch seconds', lambda items: [legacy_epoch(t) for t in items], lambda items: [transactions.epoch(t) for t in items], timestamps, args.repeat)
+    compare('transaction_record', legacy, current, records, args.repeat)
+
+    decoded = transactions.decode(records[0])
+    print(f'record size in bytes: dict {sys.getsizeof(records[0])}, compact {sys.getsizeof(decoded)}')
@@ -0,0 +1,137 @@
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta
+import argparse
+import json
+import os
+import subprocess
+import sys
+import tempfile
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from stub import Dataset, StubServer
+
+ADDR = 'tz1benchmark0000000000000000000000'
+
+# Scenario name to method, path and form of the request driving a route
+def scenarios():
+    today = datetime.now()
+    record_form = {
+        'user_addr'  : ADDR,
+        'start_time' : (today - timedelta(days=7)).strftime('%Y-%m-%d'),
+        'end_time'   : today.strftime('%Y-%m-%d'),
+        'platform'   : ['akaobj', 'asmeir', 'tezdozen', 'td-guardian', 'hicetnunc'],
+        'type'       : ['general', 'gacha', 'auction', 'bundle'],
+        'action'     : ['mint', 'sell', 'burn', 'transfer', 'collect', 'swap', 'make', 'cancel']
+    }
+    return {
+        'ranking_creation'   : ('GET',  f'/ranking/creation?creator_addr={ADDR}&option=tradeVolume&reverse=reverse_True&platform=akaobj', None),
+        'ranking_collection' : ('GET',  f'/ranking/collection?collector_addr={ADDR}&option=collectiblePrice&reverse=reverse_True&platform=akaobj', None),
+        'ranking_gacha'      : ('GET',  '/ranking/gacha?option=gachaRate&reverse=reverse_True&filter=filter_False', None),
+        'ranking_auction'    : ('GET',  '/ranking/auction?option=dueTime&reverse=reverse_False', None),
+        'ranking_bundle'     : ('GET',  '/ranking/bundle?option=bundleItemAmount&reverse=reverse_True', None),
+        'ranking_volume'     : ('GET',  '/ranking/volume?kind=token&window=7d&option=volume', None),
+        'history'            : ('POST', '/history', {'platform' : 'akaobj', 'token_id' : '1'}),
+        'history_data'       : ('GET',  '/history/data?platform=akaobj&token_id=1', None),
+        'record'             : ('POST', '/record', record_form),
+        'api_ranking'        : ('GET',  f'/api/ranking/creator?addr={ADDR}&option=amount&reverse=reverse_True&platform=akaobj', None),
+        'api_history'        : ('GET',  '/api/history?platform=akaobj&token_id=1', None),
+        'api_record'         : ('GET',  f"/api/record?addr={ADDR}&start_time={record_form['start_time']}&end_time={record_form['end_time']}", None)
+    }
+
+def percentile(values, q):
+    values = sorted(values)
+    return values[min(int(len(values) * q / 100), len(values) - 1)] if values else None
+
+# Send one request and read the whole body, streamed pages included
+def drive(client, method, path, form, headers=None):
+    start = time.perf_counter()
+    response = client.open(path, method=method, data=form, headers=headers)
+    response.get_data()
+    response.close()
+    return time.perf_counter() - start, response.status_code
+
+# Measure one scale in a fresh process, so caches and local stores start empty
+def measure(args):
+    stub = StubServer(Dataset(args.scale, args.records_per_token), latency=args.latency, jitter=args.jitter, error_rate=args.error_rate, capacity=args.capacity).start()
+    workdir = tempfile.mkdtemp(prefix='akaswap-bench-')
+    os.environ.update(stub.environ())
+    os.environ['RECORD_STORE_PATH'] = os.path.join(workdir, 'records.db')
+    os.environ['THUMB_CACHE_DIR'] = os.path.join(workdir, 'thumbs')
+    os.environ.setdefault('SLOW_REQUEST_SECONDS', '0')
+    sys.path.insert(0, ROOT)
+    import app
+
+    app.app.secret_key = os.urandom(16)
+    selected = args.routes.split(',') if args.routes else list(scenarios())
+    for name in selected:
+        method, path, form = scenarios()[name]
+        # Api clients accept gzip as browsers and requests do, so compressed responses are measured
+        headers = {'Accept-Encoding' : 'gzip'} if name.startswith('api_') else None
+        stub.reset()
+        cold, cold_status = drive(app.app.test_client(), method, path, form, headers)
+        cold_calls = sum(stub.reset().values())
+
+        clients = [app.app.test_client() for _ in range(args.concurrency)]
+        start = time.perf_counter()
+        with ThreadPoolExecutor(max_workers=args.concurrency) as executor:
+            results = list(executor.map(lambda i: drive(clients[i % args.concurrency], method, path, form, headers), range(args.requests)))
+        elapsed = time.perf_counter() - start
+        warm_calls = sum(stub.reset().values())
+
+        latencies = [seconds for seconds, status in results]
+        print(json.dumps({
+            'scale'                : args.scale,
+            'route'                : name,
+            'cold'                 : cold,
+            'cold_status'          : cold_status,
+            'cold_upstream'        : cold_calls,
+            'p50'                  : percentile(latencies, 50),
+            'p99'                  : percentile(latencies, 99),
+            'throughput'           : len(results) / elapsed if elapsed else None,
+            'errors'               : sum(1 for seconds, status in results if status >= 400),
+            'upstream_per_request' : warm_calls / len(results) if results else 0
+        }), flush=True)
+    stub.stop()
+
+def report(rows):
+    print(f"{'scale':>6} {'route':<20} {'status':>6} {'cold s':>8} {'calls':>6} {'p50 ms':>8} {'p99 ms':>8} {'req/s':>8} {'calls/req':>9} {'errors':>6}")
+    for row in rows:
+        print(f"{row['scale']:>6} {row['route']:<20} {row['cold_status']:>6} {row['cold']:>8.3f} {row['cold_upstream']:>6} "
+              f"{row['p50'] * 1000:>8.1f} {row['p99'] * 1000:>8.1f} {row['throughput']:>8.1f} {row['upstream_per_request']:>9.2f} {row['errors']:>6}")
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Benchmark the app routes against the local stub server')
+    parser.add_argument('--scales', default='10,1000,50000', help='comma separated dataset sizes')
+    parser.add_argument('--routes', default='', help='comma separated scenarios, all by default')
+    parser.add_argument('--requests', type=int, default=50, help='warm requests per route')
+    parser.add_argument('--concurrency', type=int, default=8)
+    parser.add_argument('--records-per-token', type=int, default=20)
+    parser.add_argument('--latency', type=float, default=0.02, help='seconds added to every upstream response')
+    parser.add_argument('--jitter', type=float, default=0.005)
+    parser.add_argument('--error-rate', type=float, default=0.0)
+    parser.add_argument('--capacity', type=int, default=0, help='upstream requests in flight above this are refused with 429')
+    parser.add_argument('--json', action='store_true', help='print raw rows as json lines')
+    parser.add_argument('--scale', type=int, help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.scale is not None:
+        measure(args)
+        sys.exit()
+
+    rows = []
+    for scale in args.scales.split(','):
+        command = [
+            sys.executable, os.path.abspath(__file__), '--scale', scale, '--routes', args.routes,
+            '--requests', str(args.requests), '--concurrency', str(args.concurrency), '--records-per-token', str(args.records_per_token),
+            '--latency', str(args.latency), '--jitter', str(args.jitter), '--error-rate', str(args.error_rate), '--capacity', str(args.capacity)
+        ]
+        output = subprocess.run(command, check=True, stdout=subprocess.PIPE, text=True).stdout
+        rows += [json.loads(line) for line in output.splitlines() if line.startswith('{')]
+    if args.json:
+        for row in rows:
+            print(json.dumps(row))
+    else:
+        report(rows)
@@ -0,0 +1,78 @@
+import argparse
+import json
+import os
+import subprocess
+import sys
+import tempfile
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+# Cumulative import time in seconds of `import app` and of the modules it imports directly, slowest first
+def import_times(env):
+    result = subprocess.run([sys.executable, '-X', 'importtime', '-c', 'import app'], cwd=ROOT, env=env, stderr=subprocess.PIPE, text=True, check=True)
+    modules = []
+    for line in result.stderr.splitlines():
+        if not line.startswith('import time:') or 'cumulative' in line:
+            continue
+        self_us, cumulative_us, name = line[len('import time:'):].split('|')
+        # Nested imports are indented by two spaces per level under the module importing them
+        depth = (len(name) - len(name.lstrip()) - 1) // 2
+        if depth <= 1:
+            modules.append(('  ' * depth + name.strip(), int(cumulative_us) / 1e6))
+    return sorted(modules, key=lambda module: module[1], reverse=True)
+
+# Time to import and configure the app, and its first requests, in this fresh process
+def cold_start():
+    from stub import Dataset, StubServer
+    stub = StubServer(Dataset(100)).start()
+    os.environ.update(stub.environ())
+    sys.path.insert(0, ROOT)
+
+    timings = dict()
+    start = time.perf_counter()
+    import app
+    timings['import app'] = time.perf_counter() - start
+
+    start = time.perf_counter()
+    app.create_app()
+    timings['create_app'] = time.perf_counter() - start
+    timings['pyecharts loaded at boot'] = 'pyecharts' in sys.modules
+
+    client = app.app.test_client()
+    for name, method, path, form in [
+        ('first GET /', 'GET', '/', None),
+        ('first GET /ranking', 'GET', '/ranking', None),
+        ('first POST /history', 'POST', '/history', {'platform' : 'akaobj', 'token_id' : '1'}),
+        ('second POST /history', 'POST', '/history', {'platform' : 'akaobj', 'token_id' : '2'})
+    ]:
+        start = time.perf_counter()
+        response = client.open(path, method=method, data=form)
+        response.get_data()
+        response.close()
+        timings[name] = time.perf_counter() - start
+    stub.stop()
+    print(json.dumps(timings))
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Report import time and cold start of the app')
+    parser.add_argument('--top', type=int, default=10, help='slowest top-level imports shown')
+    parser.add_argument('--cold', action='store_true', help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.cold:
+        cold_start()
+        sys.exit()
+
+    workdir = tempfile.mkdtemp(prefix='akaswap-startup-')
+    env = dict(os.environ, RECORD_STORE_PATH=os.path.join(workdir, 'records.db'), THUMB_CACHE_DIR=os.path.join(workdir, 'thumbs'))
+    modules = import_times(env)
+    print('Import time of `import app` and its slowest direct imports, cumulative seconds')
+    for name, seconds in modules[:args.top]:
+        print(f'  {seconds:>8.3f}  {name}')
+
+    output = subprocess.run([sys.executable, os.path.abspath(__file__), '--cold'], env=env, stdout=subprocess.PIPE, text=True, check=True).stdout
+    print('Cold start, seconds')
+    for name, value in json.loads(output.splitlines()[-1]).items():
+        print(f'  {value:>8.3f}  {name}' if not isinstance(value, bool) else f'  {str(value):>8}  {name}')
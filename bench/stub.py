@@ -0,0 +1,302 @@
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import urlsplit, parse_qs
+from datetime import datetime, timezone
+import argparse
+import json
+import random
+import re
+import struct
+import threading
+import time
+import zlib
+
+# Contracts of the platforms ranked by the app
+CONTRACTS = [
+    'KT1AFq5XorPduoYyWxs5gEyrFK6fVjJVbtCj',
+    'KT1VTBuWpY5f4sEdCHVWRSn99yUS5HqVWVk2',
+    'KT1Xphnv7A1sUgRwZsecmAGFWm7WNxJz76ax',
+    'KT1ShjqosdcqJBhaabPvkCwoXtS1R2dEbx4W',
+    'KT1RJ6PbjHpwc3M5rw5s2Nbmefwbuwbdxton'
+]
+
+# Contract of gachas, auctions and bundles
+MARKET_CONTRACT = 'KT1GsdckBVCsgqp6ERYLnyawyXACAAQspPv6'
+
+RECORD_TYPES = ['collect', 'collect', 'collect_offer', 'swap', 'mint', 'sell', 'transfer', 'collect_gacha', 'collect_auction', 'collect_bundle']
+
+def iso(ts):
+    return datetime.fromtimestamp(ts, timezone.utc).strftime('%Y-%m-%dT%H:%M:%SZ')
+
+def epoch(text):
+    return int(datetime.strptime(text, '%Y-%m-%dT%H:%M:%SZ').replace(tzinfo=timezone.utc).timestamp())
+
+# Png of one white pixel, served by the gateway for every cid
+def pixel():
+    def chunk(kind, data):
+        return struct.pack('>I', len(data)) + kind + data + struct.pack('>I', zlib.crc32(kind + data))
+    header = struct.pack('>IIBBBBB', 1, 1, 8, 2, 0, 0, 0)
+    return b'\x89PNG\r\n\x1a\n' + chunk(b'IHDR', header) + chunk(b'IDAT', zlib.compress(b'\x00\xff\xff\xff')) + chunk(b'IEND', b'')
+
+PIXEL = pixel()
+
+def address(i):
+    return f'tz1stub{i:029d}'
+
+# Synthetic data of a given size, every item is derived from its index so nothing is held in memory
+class Dataset:
+    def __init__(self, scale, records_per_token=20, now=None):
+        self.scale = scale
+        self.records_per_token = records_per_token
+        self.now = int(now or time.time())
+        # Account records are spread over the last week
+        self.step = max(7 * 86400 // max(scale, 1), 1)
+
+    def token(self, contract, token_id, owner=None):
+        rng = random.Random(f'{contract}/{token_id}')
+        owners = {address(rng.randrange(1000)) : rng.randint(1, 5) for _ in range(rng.randint(1, 4))}
+        if owner:
+            owners[owner] = rng.randint(1, 5)
+        return {
+            'tokenId'           : token_id,
+            'contract'          : contract,
+            'name'              : f'Stub Token {token_id}',
+            'creators'          : [address(token_id % 100)],
+            'amount'            : rng.randint(1, 50),
+            'displayUri'        : f'ipfs://QmStub{token_id:040d}',
+            'owners'            : owners,
+            'ownerAliases'      : {addr : f'owner-{addr[-4:]}' for addr in owners if rng.random() < 0.5},
+            'highestSoldPrice'  : rng.randint(1, 500) * 100000,
+            'recentlySoldPrice' : rng.randint(1, 500) * 100000,
+            'sale'              : {'swaps' : [{'xtzPerToken' : rng.randint(1, 500) * 100000} for _ in range(rng.randint(0, 3))]}
+        }
+
+    def record(self, i, ts, contract=None, token_id=None):
+        rng = random.Random(f'record/{contract}/{token_id}/{i}')
+        contract = contract or CONTRACTS[rng.randrange(len(CONTRACTS))]
+        token_id = rng.randrange(max(self.scale, 1)) if token_id is None else token_id
+        sender, receiver = address(rng.randrange(1000)), address(rng.randrange(1000))
+        return {
+            'timestamp' : iso(ts),
+            'type'      : rng.choice(RECORD_TYPES),
+            'price'     : rng.randint(1, 500) * 100000,
+            'amount'    : rng.randint(1, 3),
+            'from'      : sender,
+            'to'        : receiver,
+            'fromAlias' : f'from-{sender[-4:]}' if rng.random() < 0.3 else None,
+            'toAlias'   : f'to-{receiver[-4:]}' if rng.random() < 0.3 else None,
+            'contract'  : contract,
+            'tokenId'   : token_id,
+            'tokenName' : f'Stub Token {token_id}'
+        }
+
+    # Tokens created or collected by address on contracts
+    def account_tokens(self, addr, target, contracts, limit, offset):
+        count = len(contracts) * self.scale
+        owner = addr if target == 'collection' else None
+        tokens = [self.token(contracts[j // self.scale], j % self.scale, owner) for j in range(offset, min(offset + limit, count))]
+        return {'count' : count, 'tokens' : tokens}
+
+    # Records of account newest first within the time window
+    def account_records(self, start, end, limit, offset):
+        first = max((self.now - end) // self.step, 0) if end is not None else 0
+        last = min((self.now - start) // self.step, self.scale - 1) if start is not None else self.scale - 1
+        indices = range(first + offset, min(first + offset + limit, last + 1))
+        return {'count' : max(last - first + 1, 0), 'records' : [self.record(i, self.now - i * self.step) for i in indices]}
+
+    # Records of token newest first, the endpoint is not paged
+    def token_records(self, contract, token_id, start):
+        records = [self.record(i, self.now - i * 3600, contract, token_id) for i in range(self.records_per_token)]
+        return {'records' : [record for record in records if start is None or record['timestamp'] >= start]}
+
+    def market_item(self, type, i):
+        rng = random.Random(f'{type}/{i}')
+        issue = self.now - rng.randrange(30 * 86400)
+        token = {'displayUri' : f'ipfs://QmStub{i:040d}'}
+        item = {
+            f'{type}Id'  : i,
+            'title'      : f'Stub {type.capitalize()} {i}',
+            'contract'   : MARKET_CONTRACT,
+            'issueTime'  : iso(issue),
+            'cancelTime' : iso(issue + rng.randrange(60 * 86400))
+        }
+        if type == 'auction':
+            item.update({
+                'auctionAmount'     : rng.randint(1, 10),
+                'startPrice'        : rng.randint(1, 100) * 100000,
+                'directPrice'       : rng.randint(100, 500) * 100000,
+                'currentBidPrice'   : rng.randint(1, 300) * 100000,
+                'currentStorePrice' : rng.randint(1, 300) * 100000,
+                'raisePercentage'   : rng.randint(1, 20),
+                'dueTime'           : iso(issue + rng.randrange(14 * 86400)),
+                'token'             : token
+            })
+        else:
+            total = rng.randint(1, 100)
+            items = [{'amount' : rng.randint(1, 10), 'token' : token} for _ in range(rng.randint(1, 5))]
+            item.update({
+                f'{type}Amount'     : rng.randint(0, total),
+                f'{type}Total'      : total,
+                f'xtzPer{type.capitalize()}' : rng.randint(1, 100) * 100000,
+                f'{type}ItemAmount' : sum(entry['amount'] for entry in items),
+                f'{type}Items'      : items
+            })
+        return item
+
+    def market(self, type, limit, offset):
+        return {'count' : self.scale, f'{type}s' : [self.market_item(type, i) for i in range(offset, min(offset + limit, self.scale))]}
+
+    def accounts(self, addrs):
+        return [{'address' : addr, 'alias' : f'alias-{addr[-4:]}'} for addr in addrs]
+
+# Path pattern to endpoint template
+routes = [
+    (re.compile(r'^/tzkt/accounts$'),                                  '/accounts'),
+    (re.compile(r'^/akaswap/fa2tokens/(?P<contract>\w+)/(?P<token_id>\d+)$'),     '/fa2tokens/{contract}/{token_id}'),
+    (re.compile(r'^/site/fa2tokens/(?P<contract>\w+)/(?P<token_id>\d+)/records$'), '/fa2tokens/{contract}/{token_id}/records'),
+    (re.compile(r'^/site/accounts/(?P<addr>\w+)/(?P<target>creation|collection)s$'), '/accounts/{addr}/{target}s'),
+    (re.compile(r'^/akaswap/accounts/(?P<addr>\w+)/records$'),          '/accounts/{addr}/records'),
+    (re.compile(r'^/akaswap/records$'),                                 '/records'),
+    (re.compile(r'^/akaswap/(?P<type>gacha|auction|bundle)s$'),         '/{type}s'),
+    (re.compile(r'^/ipfs/(?P<cid>[\w/.\-]+)$'),                          '/ipfs/{cid}')
+]
+
+# Stub of the akaSwap and TzKT endpoints used by the app, with injected latency and errors
+class StubServer:
+    def __init__(self, dataset, host='127.0.0.1', port=0, latency=0.0, jitter=0.0, error_rate=0.0, error_status=503, capacity=0, retry_after=1):
+        self.dataset = dataset
+        self.latency, self.jitter = latency, jitter
+        self.error_rate, self.error_status = error_rate, error_status
+        # Requests in flight above capacity are refused with 429
+        self.capacity, self.retry_after = capacity, retry_after
+        self.inflight = self.refused = 0
+        self.calls = dict()
+        self.lock = threading.Lock()
+        self.rng = random.Random(0)
+        self.server = ThreadingHTTPServer((host, port), self.handler())
+        self.server.daemon_threads = True
+        self.thread = None
+
+    @property
+    def url(self):
+        host, port = self.server.server_address[:2]
+        return f'http://{host}:{port}'
+
+    # Base urls to export as AKASWAP_API, AKASWAP_SITE, TZKT_API and IPFS_GATEWAY
+    def environ(self):
+        return {'AKASWAP_API' : f'{self.url}/akaswap', 'AKASWAP_SITE' : f'{self.url}/site', 'TZKT_API' : f'{self.url}/tzkt', 'IPFS_GATEWAY' : f'{self.url}/ipfs'}
+
+    def count(self, template):
+        with self.lock:
+            self.calls[template] = self.calls.get(template, 0) + 1
+
+    def reset(self):
+        with self.lock:
+            calls, self.calls = self.calls, dict()
+        return calls
+
+    def respond(self, path, query):
+        for pattern, template in routes:
+            match = pattern.match(path)
+            if match:
+                break
+        else:
+            return None, 404, {'error' : 'Not Found'}
+
+        with self.lock:
+            delay = max(self.latency + self.rng.uniform(-self.jitter, self.jitter), 0)
+            failed = self.rng.random() < self.error_rate
+        time.sleep(delay)
+        if failed:
+            return template, self.error_status, {'error' : 'Injected Error'}
+
+        args = match.groupdict()
+        limit = int(query.get('limit', 100))
+        offset = int(query.get('offset', 0))
+        data = self.dataset
+        if template == '/ipfs/{cid}':
+            return template, 200, PIXEL
+        if template == '/accounts':
+            return template, 200, data.accounts(query.get('address.in', '').split(','))
+        if template == '/fa2tokens/{contract}/{token_id}':
+            if int(args['token_id']) >= data.scale:
+                return template, 404, {'error' : 'Not Found'}
+            return template, 200, data.token(args['contract'], int(args['token_id']))
+        if template == '/fa2tokens/{contract}/{token_id}/records':
+            return template, 200, data.token_records(args['contract'], int(args['token_id']), query.get('startTime'))
+        if template == '/accounts/{addr}/{target}s':
+            contracts = query['contracts'].split(',') if query.get('contracts') else CONTRACTS
+            return template, 200, data.account_tokens(args['addr'], args['target'], contracts, limit, offset)
+        if template == '/accounts/{addr}/records' or template == '/records':
+            start = epoch(query['startTime']) if query.get('startTime') else None
+            end = epoch(query['endTime']) if query.get('endTime') else None
+            return template, 200, data.account_records(start, end, limit, offset)
+        return template, 200, data.market(args['type'], limit, offset)
+
+    def handler(self):
+        stub = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = 'HTTP/1.1'
+
+            def do_GET(self):
+                parts = urlsplit(self.path)
+                query = {k : v[-1] for k, v in parse_qs(parts.query).items()}
+                with stub.lock:
+                    stub.inflight += 1
+                    refused = stub.capacity and stub.inflight > stub.capacity
+                    stub.refused += bool(refused)
+                try:
+                    if refused:
+                        template, status, payload = None, 429, {'error' : 'Too Many Requests'}
+                    else:
+                        template, status, payload = stub.respond(parts.path, query)
+                finally:
+                    with stub.lock:
+                        stub.inflight -= 1
+                # Gateway downloads warm thumbnails in background, they are not counted as api calls
+                if template and template != '/ipfs/{cid}':
+                    stub.count(template)
+                image = isinstance(payload, bytes)
+                body = payload if image else json.dumps(payload).encode()
+                self.send_response(status)
+                self.send_header('Content-Type', 'image/png' if image else 'application/json')
+                if status in (429, 503):
+                    self.send_header('Retry-After', str(stub.retry_after))
+                self.send_header('Content-Length', str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, format, *args):
+                pass
+
+        return Handler
+
+    def start(self):
+        self.thread = threading.Thread(target=self.server.serve_forever, name='stub-server', daemon=True)
+        self.thread.start()
+        return self
+
+    def stop(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Serve synthetic akaSwap and TzKT data')
+    parser.add_argument('--port', type=int, default=8765)
+    parser.add_argument('--scale', type=int, default=1000, help='tokens per platform, catalog items and account records')
+    parser.add_argument('--records-per-token', type=int, default=20)
+    parser.add_argument('--latency', type=float, default=0.0, help='seconds added to every response')
+    parser.add_argument('--jitter', type=float, default=0.0, help='latency varies uniformly by this many seconds')
+    parser.add_argument('--error-rate', type=float, default=0.0, help='share of responses failing with --error-status')
+    parser.add_argument('--error-status', type=int, default=503)
+    parser.add_argument('--capacity', type=int, default=0, help='requests in flight above this are refused with 429, 0 for no limit')
+    parser.add_argument('--retry-after', type=int, default=1, help='Retry-After seconds sent with 429 and 503')
+    args = parser.parse_args()
+
+    stub = StubServer(
+        Dataset(args.scale, args.records_per_token), port=args.port, latency=args.latency, jitter=args.jitter,
+        error_rate=args.error_rate, error_status=args.error_status, capacity=args.capacity, retry_after=args.retry_after
+    )
+    for name, value in stub.environ().items():
+        print(f'export {name}={value}')
+    stub.server.serve_forever()
@@ -0,0 +1,182 @@
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor, Future
+import json
+import logging
+import threading
+import time
+import db
+
+logger = logging.getLogger(__name__)
+
+# Workers refreshing stale entries in background
+refresher = ThreadPoolExecutor(max_workers=2, thread_name_prefix='cache-refresh')
+
+# Entry of cache
+class Entry:
+    __slots__ = ['value', 'expires', 'stale_until']
+
+    def __init__(self, value, expires, stale_until):
+        self.value = value
+        self.expires = expires
+        self.stale_until = stale_until
+
+# Disk tier of cache stored in sqlite, values must be json serializable
+class DiskTier:
+    def __init__(self, path):
+        self.lock = threading.Lock()
+        self.connection = db.Connection(path, "CREATE TABLE IF NOT EXISTS cache (key TEXT PRIMARY KEY, value TEXT, expires REAL, stale_until REAL)")
+        self.writes = 0
+
+    @property
+    def db(self):
+        return self.connection.get()
+
+    def get(self, key):
+        with self.lock:
+            row = self.db.execute("SELECT value, expires, stale_until FROM cache WHERE key = ?", (key,)).fetchone()
+        if row is None:
+            return None
+        return Entry(json.loads(row[0]), row[1], row[2])
+
+    def set(self, key, entry):
+        with self.lock:
+            self.db.execute("REPLACE INTO cache VALUES (?, ?, ?, ?)", (key, json.dumps(entry.value), entry.expires, entry.stale_until))
+            self.writes += 1
+            # Prune dead entries now and then
+            if self.writes % 500 == 0:
+                self.db.execute("DELETE FROM cache WHERE stale_until < ?", (time.time(),))
+            self.db.commit()
+
+# Calls in flight by key, concurrent callers of the same key share the first call
+class SingleFlight:
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.calls = dict()
+        self.shared = 0
+
+    # Result of fn and whether it was shared with another caller
+    def do(self, key, fn):
+        with self.lock:
+            call = self.calls.get(key)
+            leader = call is None
+            if leader:
+                call = self.calls[key] = Future()
+            else:
+                self.shared += 1
+        if not leader:
+            return call.result(), True
+
+        try:
+            result = fn()
+        except BaseException as e:
+            call.set_exception(e)
+            raise
+        else:
+            call.set_result(result)
+            return result, False
+        finally:
+            with self.lock:
+                del self.calls[key]
+
+# Size bounded LRU cache with ttl per entry and optional stale-while-revalidate
+class TTLCache:
+    def __init__(self, maxsize, stale_ttl=0, disk_path=None):
+        self.maxsize = maxsize
+        self.stale_ttl = stale_ttl
+        self.entries = OrderedDict()
+        self.lock = threading.Lock()
+        self.refreshing = set()
+        self.disk = DiskTier(disk_path) if disk_path else None
+        self.hits = self.misses = self.stale_hits = self.evictions = self.disk_hits = 0
+
+    # Find entry in memory, then on disk
+    def lookup(self, key):
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is not None:
+                self.entries.move_to_end(key)
+                return entry
+        if self.disk is not None:
+            entry = self.disk.get(key)
+            if entry is not None and entry.stale_until > time.time():
+                self.disk_hits += 1
+                self.store(key, entry, persist=False)
+                return entry
+        return None
+
+    def store(self, key, entry, persist=True):
+        with self.lock:
+            self.entries[key] = entry
+            self.entries.move_to_end(key)
+            while len(self.entries) > self.maxsize:
+                self.entries.popitem(last=False)
+                self.evictions += 1
+        if persist and self.disk is not None:
+            self.disk.set(key, entry)
+
+    def set(self, key, value, ttl):
+        now = time.time()
+        self.store(key, Entry(value, now + ttl, now + ttl + self.stale_ttl))
+
+    def invalidate(self, key):
+        with self.lock:
+            self.entries.pop(key, None)
+
+    # Return cached value or load it, stale values are served while loading in background
+    # Loaded values failing the cacheable check are returned without being stored
+    # With fallback an expired value still held is served when loading fails
+    def get_or_load(self, key, loader, ttl, stale=False, cacheable=None, fallback=False):
+        entry = self.lookup(key)
+        now = time.time()
+        if entry is not None:
+            if entry.expires > now:
+                self.hits += 1
+                return entry.value
+            if stale and entry.stale_until > now:
+                self.stale_hits += 1
+                self.revalidate(key, loader, ttl, cacheable)
+                return entry.value
+        self.misses += 1
+        try:
+            value = loader()
+        except Exception as e:
+            if not fallback or entry is None:
+                raise
+            logger.warning('Serving expired %s after loading failed: %r', key, e)
+            self.stale_hits += 1
+            return entry.value
+        if cacheable is None or cacheable(value):
+            self.set(key, value, ttl)
+        return value
+
+    def revalidate(self, key, loader, ttl, cacheable=None):
+        with self.lock:
+            if key in self.refreshing:
+                return
+            self.refreshing.add(key)
+
+        def refresh():
+            try:
+                value = loader()
+                if cacheable is None or cacheable(value):
+                    self.set(key, value, ttl)
+            except Exception:
+                logger.warning('Refreshing %s failed', key, exc_info=True)
+            finally:
+                with self.lock:
+                    self.refreshing.discard(key)
+
+        refresher.submit(refresh)
+
+    def stats(self):
+        lookups = self.hits + self.stale_hits + self.misses
+        return {
+            'size'       : len(self.entries),
+            'maxsize'    : self.maxsize,
+            'hits'       : self.hits,
+            'stale_hits' : self.stale_hits,
+            'disk_hits'  : self.disk_hits,
+            'misses'     : self.misses,
+            'evictions'  : self.evictions,
+            'hit_ratio'  : round((self.hits + self.stale_hits) / lookups, 4) if lookups else None
+        }
@@ -0,0 +1,113 @@
+import os
+
+# Read setting from environment
+def env(name, default, cast=str):
+    value = os.environ.get(name)
+    if value is None or value == '':
+        return default
+    if cast is bool:
+        return value.lower() in ['1', 'true', 'yes', 'on']
+    return cast(value)
+
+# Serving
+SECRET_KEY         = env('SECRET_KEY', None)
+DEBUG              = env('DEBUG', False, bool)
+TEMPLATE_CACHE_DIR = env('TEMPLATE_CACHE_DIR', None)
+
+# Upstream base urls
+AKASWAP_API  = env('AKASWAP_API', 'https://api.akaswap.com/v2')
+AKASWAP_SITE = env('AKASWAP_SITE', 'https://akaswap.com/api/v2')
+TZKT_API     = env('TZKT_API', 'https://api.tzkt.io/v1')
+
+# Upstream client
+UPSTREAM_CONNECT_TIMEOUT = env('UPSTREAM_CONNECT_TIMEOUT', 3.05, float)
+UPSTREAM_READ_TIMEOUT    = env('UPSTREAM_READ_TIMEOUT', 20.0, float)
+UPSTREAM_RETRIES         = env('UPSTREAM_RETRIES', 2, int)
+UPSTREAM_BACKOFF         = env('UPSTREAM_BACKOFF', 0.3, float)
+UPSTREAM_POOL_SIZE       = env('UPSTREAM_POOL_SIZE', 32, int)
+UPSTREAM_CONCURRENCY     = env('UPSTREAM_CONCURRENCY', 8, int)
+UPSTREAM_MAX_INFLIGHT    = env('UPSTREAM_MAX_INFLIGHT', 16, int)
+
+# Per-host limits of upstream requests, a rate of 0 is unlimited
+# Concurrency adapts between the minimum and UPSTREAM_MAX_INFLIGHT
+UPSTREAM_RATE            = env('UPSTREAM_RATE', 50.0, float)
+UPSTREAM_BURST           = env('UPSTREAM_BURST', 50, int)
+UPSTREAM_MIN_CONCURRENCY = env('UPSTREAM_MIN_CONCURRENCY', 1, int)
+
+# Consecutive failures opening the circuit of a host and seconds before it is probed again
+CIRCUIT_THRESHOLD = env('CIRCUIT_THRESHOLD', 5, int)
+CIRCUIT_COOLDOWN  = env('CIRCUIT_COOLDOWN', 30, int)
+
+# Async serving mode
+ASYNC_HOST            = env('ASYNC_HOST', '127.0.0.1')
+ASYNC_PORT            = env('ASYNC_PORT', 5000, int)
+ASYNC_MAX_CONNECTIONS = env('ASYNC_MAX_CONNECTIONS', 1000, int)
+
+# Records fetched per page of transaction records
+RECORD_PAGE_SIZE = env('RECORD_PAGE_SIZE', 100, int)
+
+# Response cache
+CACHE_SIZE      = env('CACHE_SIZE', 4096, int)
+CACHE_STALE     = env('CACHE_STALE', False, bool)
+CACHE_STALE_TTL = env('CACHE_STALE_TTL', 300, int)
+CACHE_DISK_PATH = env('CACHE_DISK_PATH', None)
+
+# Seconds between refreshes of gacha, auction and bundle catalogs
+CATALOG_REFRESH_INTERVAL = env('CATALOG_REFRESH_INTERVAL', 60, int)
+
+# Tokens per page of rankings, 0 ranks everything on one page
+RANKING_PAGE_SIZE = env('RANKING_PAGE_SIZE', 100, int)
+
+# Compression of api responses
+GZIP_MIN_SIZE = env('GZIP_MIN_SIZE', 500, int)
+GZIP_LEVEL    = env('GZIP_LEVEL', 6, int)
+
+# Per-token statistics kept in memory
+STATS_TTL = env('STATS_TTL', 300, int)
+
+# Charts of price history
+CLIENT_CHARTS      = env('CLIENT_CHARTS', False, bool)
+CHART_CACHE_SIZE   = env('CHART_CACHE_SIZE', 256, int)
+CHART_TTL          = env('CHART_TTL', 3600, int)
+CHART_DATA_MAX_AGE = env('CHART_DATA_MAX_AGE', 60, int)
+CHART_MAX_POINTS   = env('CHART_MAX_POINTS', 1000, int)
+ROLLING_WINDOW     = env('ROLLING_WINDOW', 10, int)
+
+# Local record store
+RECORD_STORE_PATH = env('RECORD_STORE_PATH', 'records.db')
+ALIAS_TTL         = env('ALIAS_TTL', 7 * 86400, int)
+# Seconds before the collection ledger of an address is synced with upstream again
+LEDGER_SYNC_SECONDS = env('LEDGER_SYNC_SECONDS', 60, int)
+
+# Requests slower than this many seconds are logged with their phases, 0 disables the log
+SLOW_REQUEST_SECONDS = env('SLOW_REQUEST_SECONDS', 2.0, float)
+
+# Account records cached by UTC+8 day, days older than the settle time never change
+SHARD_CACHE_SIZE     = env('SHARD_CACHE_SIZE', 1024, int)
+SHARD_SETTLE_SECONDS = env('SHARD_SETTLE_SECONDS', 600, int)
+
+# Thumbnails of ipfs images, resized when Pillow is installed
+IPFS_GATEWAY           = env('IPFS_GATEWAY', 'https://ipfs.io/ipfs')
+THUMB_CACHE_DIR        = env('THUMB_CACHE_DIR', 'thumbs')
+THUMB_CACHE_BYTES      = env('THUMB_CACHE_BYTES', 512 * 1024 * 1024, int)
+THUMB_SIZE             = env('THUMB_SIZE', 160, int)
+THUMB_LARGE_SIZE       = env('THUMB_LARGE_SIZE', 600, int)
+THUMB_QUALITY          = env('THUMB_QUALITY', 82, int)
+THUMB_CONCURRENCY      = env('THUMB_CONCURRENCY', 8, int)
+THUMB_READ_TIMEOUT     = env('THUMB_READ_TIMEOUT', 30.0, float)
+THUMB_MAX_SOURCE_BYTES = env('THUMB_MAX_SOURCE_BYTES', 32 * 1024 * 1024, int)
+THUMB_RETRY_SECONDS    = env('THUMB_RETRY_SECONDS', 300, int)
+
+# Live updates of history and record pages, one poller per token or address shares upstream calls among viewers
+# Streams are closed after the max seconds and reopened by browsers, each holds a worker thread while open
+# Gunicorn workers have few threads, so live updates are off there unless asked for, gunicorn sets SERVER_SOFTWARE before loading the app
+LIVE_UPDATES           = env('LIVE_UPDATES', not env('SERVER_SOFTWARE', '').startswith('gunicorn'), bool)
+LIVE_POLL_SECONDS      = env('LIVE_POLL_SECONDS', 15, int)
+LIVE_HEARTBEAT_SECONDS = env('LIVE_HEARTBEAT_SECONDS', 15, int)
+LIVE_MAX_SECONDS       = env('LIVE_MAX_SECONDS', 300, int)
+
+# Sales volume leaderboards, ingested from marketplace records every interval
+# The first ingest goes back the backfill days, all-time volume counts from there
+LEADERBOARD_INTERVAL      = env('LEADERBOARD_INTERVAL', 60, int)
+LEADERBOARD_BACKFILL_DAYS = env('LEADERBOARD_BACKFILL_DAYS', 30, int)
+LEADERBOARD_SIZE          = env('LEADERBOARD_SIZE', 1000, int)
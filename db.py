@@ -0,0 +1,28 @@
+import os
+import sqlite3
+import threading
+
+# SQLite connection opened on first use in each process, so forked workers never share one
+class Connection:
+    def __init__(self, path, *statements):
+        self.path = path
+        self.statements = statements
+        self.lock = threading.Lock()
+        self.pid = None
+        self.db = None
+        # Connections of the parent process are kept open, closing them in a child would release the parent's locks
+        self.inherited = []
+
+    def get(self):
+        pid = os.getpid()
+        if self.pid != pid:
+            with self.lock:
+                if self.pid != pid:
+                    if self.db is not None:
+                        self.inherited.append(self.db)
+                    db = sqlite3.connect(self.path, check_same_thread=False)
+                    for statement in self.statements:
+                        db.execute(statement)
+                    db.commit()
+                    self.db, self.pid = db, pid
+        return self.db
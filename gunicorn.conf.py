@@ -0,0 +1,13 @@
+# Gunicorn settings, run with: gunicorn -c gunicorn.conf.py wsgi:app
+# The app is imported once before forking, so workers start with modules loaded and templates compiled
+# SQLite connections and background threads are opened in each worker on first use
+# Settings are read from the environment here rather than through config, so config is first imported with the app,
+# after gunicorn has set SERVER_SOFTWARE, and its defaults can depend on the server
+import multiprocessing
+import os
+
+bind = os.environ.get('GUNICORN_BIND') or '0.0.0.0:8000'
+workers = int(os.environ.get('GUNICORN_WORKERS') or multiprocessing.cpu_count() * 2 + 1)
+threads = int(os.environ.get('GUNICORN_THREADS') or 4)
+timeout = int(os.environ.get('GUNICORN_TIMEOUT') or 60)
+preload_app = True
@@ -0,0 +1,282 @@
+from datetime import datetime, timedelta, timezone
+import json
+import logging
+import threading
+import time
+import config
+import db
+import ledger
+import store
+import transactions
+import upstream
+
+logger = logging.getLogger(__name__)
+
+# Window to its length in seconds, the all-time window never expires
+WINDOWS = {'24h' : 86400, '7d' : 7 * 86400, 'all' : None}
+
+# Ranked entities and orders of leaderboards
+KINDS = ['token', 'creator']
+ORDERS = ['volume', 'trades']
+
+# Change of volume, trade count and last sale of a token or creator within a window
+class Delta:
+    __slots__ = ['volume', 'trades', 'last_ts', 'last_price']
+
+    def __init__(self):
+        self.volume = 0
+        self.trades = 0
+        self.last_ts = 0
+        self.last_price = None
+
+    def add(self, ts, price, amount):
+        self.volume += price * amount
+        self.trades += 1
+        if ts >= self.last_ts:
+            self.last_ts, self.last_price = ts, price
+
+    # Sales leave a window oldest first, so the last sale stays while any trade is left
+    def remove(self, price, amount):
+        self.volume -= price * amount
+        self.trades -= 1
+
+# Kind and key of every leaderboard a sale counts towards
+def sale_keys(contract, token_id, creator):
+    yield 'token', f'{contract}/{token_id}'
+    if creator:
+        yield 'creator', creator
+
+# Sales volume of tokens and creators over rolling windows, maintained from the marketplace record stream
+# Each sale is added to a window once when ingested and removed once when it leaves it, so no window is recounted
+class VolumeIndex:
+    def __init__(self, path, contracts, interval):
+        self.contracts = contracts
+        self.interval = interval
+        self.lock = threading.Lock()
+        self.boards = None
+        self.refreshed = None
+        # Timestamp the first ingest started from, so the all-time window is titled by it
+        self.since = None
+        # Whether this process has ingested, so empty leaderboards are told apart from unbuilt ones
+        self.synced = False
+        self.thread = None
+        self.connection = db.Connection(
+            path,
+            "PRAGMA journal_mode=WAL",
+            # Sales still inside a rolling window, kept to be taken out of it later
+            """
+            CREATE TABLE IF NOT EXISTS volume_sales (
+                ts       INTEGER NOT NULL,
+                contract TEXT    NOT NULL,
+                token_id INTEGER NOT NULL,
+                creator  TEXT,
+                price    INTEGER NOT NULL,
+                amount   INTEGER NOT NULL
+            )
+            """,
+            "CREATE INDEX IF NOT EXISTS volume_sales_ts ON volume_sales (ts)",
+            """
+            CREATE TABLE IF NOT EXISTS volumes (
+                span       TEXT    NOT NULL,
+                kind       TEXT    NOT NULL,
+                key        TEXT    NOT NULL,
+                volume     INTEGER NOT NULL,
+                trades     INTEGER NOT NULL,
+                last_price INTEGER,
+                last_ts    INTEGER NOT NULL,
+                PRIMARY KEY (span, kind, key)
+            )
+            """,
+            "CREATE INDEX IF NOT EXISTS volumes_volume ON volumes (span, kind, volume)",
+            "CREATE INDEX IF NOT EXISTS volumes_trades ON volumes (span, kind, trades)",
+            "CREATE TABLE IF NOT EXISTS volume_tokens (contract TEXT NOT NULL, token_id INTEGER NOT NULL, name TEXT, creator TEXT, display_uri TEXT, PRIMARY KEY (contract, token_id))",
+            # Newest record timestamp applied, digests of records applied at it, start of each rolling window and of the first ingest
+            "CREATE TABLE IF NOT EXISTS volume_sync (name TEXT PRIMARY KEY, value TEXT NOT NULL)"
+        )
+
+    @property
+    def db(self):
+        return self.connection.get()
+
+    def sync_state(self):
+        rows = self.db.execute("SELECT name, value FROM volume_sync").fetchall()
+        return dict(rows)
+
+    # Name, creator and display uri of tokens by contract and token id
+    def token_info(self, keys):
+        with self.lock:
+            rows = [self.db.execute("SELECT name, creator, display_uri FROM volume_tokens WHERE contract = ? AND token_id = ?", key).fetchone() for key in keys]
+        return {key : tuple(row) for key, row in zip(keys, rows) if row is not None}
+
+    # Name, creator and display uri of tokens sold, unknown ones are fetched once since they never change
+    def tokens(self, records):
+        keys = list(dict.fromkeys((record['contract'], record['tokenId']) for record in records))
+        known = self.token_info(keys)
+        missing = [key for key in keys if key not in known]
+
+        def find(key):
+            reply = upstream.fetch('token', contract=key[0], token_id=key[1])
+            # A missing token is remembered without creator, any other failure retries the whole sync
+            if reply.status == 404:
+                return None
+            if reply.status != 200:
+                raise upstream.UpstreamError('Non-existent Token')
+            return reply.data
+
+        names = {(record['contract'], record['tokenId']) : record.get('tokenName') for record in records}
+        found = dict()
+        for key, token in zip(missing, upstream.gather(find, missing, strict=True)):
+            creators = (token or {}).get('creators') or [None]
+            found[key] = (token.get('name') or names[key], creators[0], token.get('displayUri')) if token else (names[key], None, None)
+        return {**known, **found}, found
+
+    # Apply marketplace records newer than the index to it, the first sync starts a backfill period ago
+    def sync(self):
+        with self.lock:
+            state = self.sync_state()
+        latest = state.get('latest')
+        boundary = set(json.loads(state.get('boundary', '[]')))
+        start = latest or (datetime.now(timezone.utc) - timedelta(days=config.LEADERBOARD_BACKFILL_DAYS)).strftime("%Y-%m-%dT%H:%M:%SZ")
+        cursor = ledger.SyncCursor(latest, boundary)
+
+        sales = [
+            record for record in cursor.records('market_records', start)
+            if record['type'] in ledger.COLLECT_TYPES and record.get('contract') in self.contracts and record.get('price')
+        ]
+
+        tokens, found = self.tokens(sales)
+        rows = [
+            (transactions.epoch(record['timestamp']), record['contract'], record['tokenId'], tokens[(record['contract'], record['tokenId'])][1], record['price'], record.get('amount') or 1)
+            for record in sales
+        ]
+        self.apply(rows, found, latest, cursor.latest, cursor.boundary, int(time.time()), None if latest else start)
+        return len(rows)
+
+    def apply(self, sales, found, latest, new_latest, new_boundary, now, since=None):
+        with self.lock:
+            self.db.execute("BEGIN IMMEDIATE")
+            state = self.sync_state()
+            # Another process synced meanwhile, its result is kept
+            if state.get('latest') != latest:
+                self.db.rollback()
+                return
+
+            deltas = dict()
+            def delta(span, kind, key):
+                return deltas.setdefault((span, kind, key), Delta())
+
+            # Take out sales that left rolling windows since the last sync
+            cutoffs = {span : now - length for span, length in WINDOWS.items() if length}
+            for span, cutoff in cutoffs.items():
+                previous = int(state.get(f'cutoff_{span}', cutoff))
+                for ts, contract, token_id, creator, price, amount in self.db.execute(
+                    "SELECT ts, contract, token_id, creator, price, amount FROM volume_sales WHERE ts >= ? AND ts < ?", (previous, cutoff)
+                ):
+                    for kind, key in sale_keys(contract, token_id, creator):
+                        delta(span, kind, key).remove(price, amount)
+
+            # Add new sales to every window they fall into, late records older than a window are left out of it
+            for ts, contract, token_id, creator, price, amount in sales:
+                for span in WINDOWS:
+                    if span not in cutoffs or ts >= cutoffs[span]:
+                        for kind, key in sale_keys(contract, token_id, creator):
+                            delta(span, kind, key).add(ts, price, amount)
+
+            longest = min(cutoffs.values())
+            self.db.executemany("INSERT INTO volume_sales VALUES (?, ?, ?, ?, ?, ?)", [sale for sale in sales if sale[0] >= longest])
+            self.db.execute("DELETE FROM volume_sales WHERE ts < ?", (longest,))
+            self.db.executemany("""
+                INSERT INTO volumes VALUES (?, ?, ?, ?, ?, ?, ?)
+                ON CONFLICT (span, kind, key) DO UPDATE SET
+                    volume     = volume + excluded.volume,
+                    trades     = trades + excluded.trades,
+                    last_price = CASE WHEN excluded.last_ts >= last_ts THEN excluded.last_price ELSE last_price END,
+                    last_ts    = MAX(last_ts, excluded.last_ts)
+            """, [(span, kind, key, d.volume, d.trades, d.last_price, d.last_ts) for (span, kind, key), d in deltas.items()])
+            self.db.execute("DELETE FROM volumes WHERE trades <= 0")
+            self.db.executemany("REPLACE INTO volume_tokens VALUES (?, ?, ?, ?, ?)", [key + token for key, token in found.items()])
+
+            new_state = {f'cutoff_{span}' : str(cutoff) for span, cutoff in cutoffs.items()}
+            if since and 'since' not in state:
+                new_state['since'] = since
+            if new_latest:
+                new_state.update(latest=new_latest, boundary=json.dumps(sorted(new_boundary)))
+            self.db.executemany("REPLACE INTO volume_sync VALUES (?, ?)", new_state.items())
+            self.db.commit()
+
+    # Read the top of every leaderboard into memory, so pages are served without touching the index
+    def load(self):
+        boards = dict()
+        with self.lock:
+            self.since = self.sync_state().get('since')
+            for span in WINDOWS:
+                for kind in KINDS:
+                    total = self.db.execute("SELECT COUNT(*) FROM volumes WHERE span = ? AND kind = ?", (span, kind)).fetchone()[0]
+                    for order in ORDERS:
+                        rows = self.db.execute(
+                            f"SELECT key, volume, trades, last_price, last_ts FROM volumes WHERE span = ? AND kind = ? ORDER BY {order} DESC, key LIMIT ?",
+                            (span, kind, config.LEADERBOARD_SIZE)
+                        ).fetchall()
+                        boards[(span, kind, order)] = (rows, total)
+
+        keys = {row[0] for (span, kind, order), (rows, total) in boards.items() if kind == 'token' for row in rows}
+        tokens = self.token_info([(key.split('/')[0], int(key.split('/')[1])) for key in keys])
+        creators = {row[0] for (span, kind, order), (rows, total) in boards.items() if kind == 'creator' for row in rows}
+        aliases = store.aliases.resolve_many(creators)
+        for board, (rows, total) in boards.items():
+            entries = []
+            for key, volume, trades, last_price, last_ts in rows:
+                entry = {'volume' : volume, 'trades' : trades, 'lastPrice' : last_price, 'lastTime' : last_ts}
+                if board[1] == 'token':
+                    contract, token_id = key.split('/')
+                    name, creator, display_uri = tokens.get((contract, int(token_id)), (None, None, None))
+                    entry.update(contract=contract, tokenId=int(token_id), name=name, creator=creator, displayUri=display_uri)
+                else:
+                    entry.update(creator=key, alias=aliases.get(key, key))
+                entries.append(entry)
+            boards[board] = (entries, total)
+        return boards
+
+    # Ingest new records, then reload the leaderboards even when ingesting failed
+    def refresh(self):
+        try:
+            added = self.sync()
+            logger.info('Volume index synced: %d sales added', added)
+            synced = True
+        except Exception:
+            logger.warning('Volume index sync failed', exc_info=True)
+            synced = False
+        boards = self.load()
+        with self.lock:
+            self.boards = boards
+            self.refreshed = time.time()
+            self.synced = self.synced or synced
+
+    # The first sync may backfill many days, so it runs here rather than in a request
+    def run(self):
+        while True:
+            try:
+                self.refresh()
+            except Exception:
+                logger.warning('Volume leaderboard refresh failed', exc_info=True)
+            time.sleep(self.interval)
+
+    def start(self):
+        with self.lock:
+            if self.thread is not None:
+                return
+            self.thread = threading.Thread(target=self.run, name='volume-index', daemon=True)
+            self.thread.start()
+
+    # Entries of a leaderboard in order, the number of ranked tokens or creators and the age of the leaderboard in seconds
+    # Until the first refresh, leaderboards are read as the index stands
+    def get(self, span, kind, order):
+        self.start()
+        if self.boards is None:
+            boards = self.load()
+            with self.lock:
+                if self.boards is None:
+                    self.boards, self.refreshed = boards, time.time()
+        with self.lock:
+            entries, total = self.boards[(span, kind, order)]
+            return entries, total, time.time() - self.refreshed
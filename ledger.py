@@ -0,0 +1,176 @@
+import hashlib
+import json
+import logging
+import threading
+import time
+import config
+import db
+import transactions
+import upstream
+
+logger = logging.getLogger(__name__)
+
+# Record types adding to or taking from the cost of a collection
+COLLECT_TYPES = {'collect', 'collect_offer', 'collect_gacha', 'collect_auction', 'collect_bundle'}
+SELL_TYPES = {'sell', 'sell_offer', 'sell_gacha', 'sell_auction', 'sell_bundle'}
+
+# Running totals of an address on a token
+class LedgerEntry:
+    __slots__ = ['collect_total', 'collect_amount', 'sell_total', 'sell_amount']
+
+    def __init__(self, collect_total=0, collect_amount=0, sell_total=0, sell_amount=0):
+        self.collect_total = collect_total
+        self.collect_amount = collect_amount
+        self.sell_total = sell_total
+        self.sell_amount = sell_amount
+
+    # Spent on collecting minus earned by selling
+    @property
+    def cost(self):
+        return self.collect_total - self.sell_total
+
+# Fields of a record that never change, aliases and token names are left out since they are edited later
+DIGEST_FIELDS = ('timestamp', 'type', 'contract', 'tokenId', 'from', 'to', 'amount', 'price', 'opHash')
+
+# Digest identifying a record among records of the same timestamp, stable across fetches
+def record_digest(record):
+    return hashlib.sha1(json.dumps([record.get(field) for field in DIGEST_FIELDS]).encode()).hexdigest()
+
+# Digest of the whole record, as boundaries were stored before, kept so such a boundary is not applied again
+def legacy_digest(record):
+    return hashlib.sha1(json.dumps(record, sort_keys=True).encode()).hexdigest()
+
+# Position of a sync in a newest-first record listing, the newest timestamp applied and digests of records applied at it
+class SyncCursor:
+    def __init__(self, latest=None, boundary=()):
+        self.latest = latest
+        self.boundary = set(boundary)
+
+    # Records of a listing that were not applied yet, from start or the cursor on, and the cursor moves past each one
+    # The listing is pinned to end when the sync starts, so records arriving meanwhile cannot shift its pages,
+    # and records seen twice anyway are yielded once
+    def records(self, name, start=None, **path):
+        latest, seen, applied = self.latest, set(self.boundary), set(self.boundary)
+        params = {'endTime' : transactions.now_timestamp()}
+        if start or latest:
+            params['startTime'] = start or latest
+        for page in upstream.iter_pages(name, 'records', config.RECORD_PAGE_SIZE, params=params, cached=False, **path):
+            for record in page:
+                timestamp = record['timestamp']
+                if latest and timestamp < latest:
+                    continue
+                digest = record_digest(record)
+                if digest in seen or timestamp == latest and legacy_digest(record) in applied:
+                    continue
+                seen.add(digest)
+
+                if self.latest is None or timestamp > self.latest:
+                    self.latest, self.boundary = timestamp, set()
+                if timestamp == self.latest:
+                    self.boundary.add(digest)
+                yield record
+
+# Per-address index of collect and sell totals by contract and token id
+class LedgerIndex:
+    def __init__(self, path):
+        self.lock = threading.Lock()
+        self.address_locks = dict()
+        # Monotonic time of the last successful sync by address
+        self.synced = dict()
+        self.connection = db.Connection(
+            path,
+            "PRAGMA journal_mode=WAL",
+            """
+            CREATE TABLE IF NOT EXISTS ledger (
+                address        TEXT    NOT NULL,
+                contract       TEXT    NOT NULL,
+                token_id       INTEGER NOT NULL,
+                collect_total  INTEGER NOT NULL,
+                collect_amount INTEGER NOT NULL,
+                sell_total     INTEGER NOT NULL,
+                sell_amount    INTEGER NOT NULL,
+                PRIMARY KEY (address, contract, token_id)
+            )
+            """,
+            # Newest record timestamp applied and digests of records applied at it
+            "CREATE TABLE IF NOT EXISTS ledger_sync (address TEXT PRIMARY KEY, latest TEXT NOT NULL, boundary TEXT NOT NULL)"
+        )
+
+    @property
+    def db(self):
+        return self.connection.get()
+
+    def address_lock(self, addr):
+        with self.lock:
+            return self.address_locks.setdefault(addr, threading.Lock())
+
+    def sync_state(self, addr):
+        with self.lock:
+            row = self.db.execute("SELECT latest, boundary FROM ledger_sync WHERE address = ?", (addr,)).fetchone()
+        return (row[0], set(json.loads(row[1]))) if row else (None, set())
+
+    # Apply records newer than the index to it, the whole history is paged on first sync
+    def sync(self, addr):
+        with self.address_lock(addr):
+            latest, boundary = self.sync_state(addr)
+            cursor = SyncCursor(latest, boundary)
+
+            deltas = dict()
+            for record in cursor.records('account_records', addr=addr):
+                if not record.get('contract') or record['type'] not in COLLECT_TYPES and record['type'] not in SELL_TYPES:
+                    continue
+                entry = deltas.setdefault((record['contract'], record['tokenId']), LedgerEntry())
+                amount, price = record.get('amount') or 0, record.get('price') or 0
+                if record['type'] in COLLECT_TYPES:
+                    entry.collect_total += amount * price
+                    entry.collect_amount += amount
+                else:
+                    entry.sell_total += amount * price
+                    entry.sell_amount += amount
+
+            if cursor.latest is None or (cursor.latest == latest and cursor.boundary == boundary):
+                return 0
+            self.apply(addr, deltas, latest, cursor.latest, cursor.boundary)
+            return len(deltas)
+
+    def apply(self, addr, deltas, latest, new_latest, new_boundary):
+        rows = [
+            (addr, contract, token_id, entry.collect_total, entry.collect_amount, entry.sell_total, entry.sell_amount)
+            for (contract, token_id), entry in deltas.items()
+        ]
+        with self.lock:
+            self.db.execute("BEGIN IMMEDIATE")
+            # Another process synced the address meanwhile, its result is kept
+            row = self.db.execute("SELECT latest FROM ledger_sync WHERE address = ?", (addr,)).fetchone()
+            if (row[0] if row else None) != latest:
+                self.db.rollback()
+                return
+            self.db.executemany("""
+                INSERT INTO ledger VALUES (?, ?, ?, ?, ?, ?, ?)
+                ON CONFLICT (address, contract, token_id) DO UPDATE SET
+                    collect_total  = collect_total  + excluded.collect_total,
+                    collect_amount = collect_amount + excluded.collect_amount,
+                    sell_total     = sell_total     + excluded.sell_total,
+                    sell_amount    = sell_amount    + excluded.sell_amount
+            """, rows)
+            self.db.execute("REPLACE INTO ledger_sync VALUES (?, ?, ?)", (addr, new_latest, json.dumps(sorted(new_boundary))))
+            self.db.commit()
+
+    # Ledger entries of address by contract and token id, synced at most once per interval
+    # When syncing fails, entries already stored are served and only an address never synced raises
+    def entries(self, addr):
+        if time.monotonic() - self.synced.get(addr, float('-inf')) >= config.LEDGER_SYNC_SECONDS:
+            try:
+                self.sync(addr)
+                self.synced[addr] = time.monotonic()
+            except upstream.UpstreamError:
+                if self.sync_state(addr)[0] is None:
+                    raise
+                logger.warning('Ledger sync of %s failed, stored entries are served', addr, exc_info=True)
+        with self.lock:
+            rows = self.db.execute(
+                "SELECT contract, token_id, collect_total, collect_amount, sell_total, sell_amount FROM ledger WHERE address = ?", (addr,)
+            ).fetchall()
+        return {(row[0], row[1]) : LedgerEntry(*row[2:]) for row in rows}
+
+index = LedgerIndex(config.RECORD_STORE_PATH)
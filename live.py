@@ -0,0 +1,87 @@
+import json
+import logging
+import threading
+import time
+import config
+import metrics
+
+logger = logging.getLogger(__name__)
+
+# Poller of one subscription key shared by all its viewers
+# Every poll bumps the version, subscribers then read what is new to them from the refreshed source
+class Feed:
+    def __init__(self, page, key, poll):
+        self.page = page
+        self.key = key
+        self.poll = poll
+        self.version = 0
+        self.subscribers = 0
+        self.condition = threading.Condition()
+        self.thread = None
+
+    def run(self):
+        while True:
+            try:
+                self.poll()
+            except Exception:
+                metrics.live_polls.add(1, page=self.page, outcome='error')
+                logger.warning('Polling %s failed', self.key, exc_info=True)
+            else:
+                metrics.live_polls.add(1, page=self.page, outcome='ok')
+                with self.condition:
+                    self.version += 1
+                    self.condition.notify_all()
+            time.sleep(config.LIVE_POLL_SECONDS)
+            # The poller stops once nobody watches, under the lock so no subscriber joins a stopped feed
+            with lock:
+                if not self.subscribers:
+                    del feeds[self.key]
+                    return
+
+    # Wait until the version differs from the given one or the timeout passes
+    def wait(self, version, timeout):
+        with self.condition:
+            self.condition.wait_for(lambda: self.version != version, timeout)
+            return self.version
+
+# Feeds by subscription key
+feeds = dict()
+lock = threading.Lock()
+
+def join(page, key, poll):
+    with lock:
+        feed = feeds.get(key)
+        if feed is None:
+            feed = feeds[key] = Feed(page, key, poll)
+            feed.thread = threading.Thread(target=feed.run, name=f'live-{key}', daemon=True)
+            feed.thread.start()
+        feed.subscribers += 1
+    metrics.live_subscribers.add(1, page=page)
+    return feed
+
+def leave(feed):
+    with lock:
+        feed.subscribers -= 1
+    metrics.live_subscribers.add(-1, page=feed.page)
+
+# Server-sent events of items newer than the last seen position, read after every poll of the shared feed
+# read(since) returns new items in order and the position of the last one
+def events(page, key, poll, read, since):
+    feed = join(page, key, poll)
+    try:
+        deadline = time.monotonic() + config.LIVE_MAX_SECONDS
+        # Browsers wait a poll before reconnecting after the stream is closed
+        yield f'retry: {config.LIVE_POLL_SECONDS * 1000}\n\n'
+        seen = None
+        while time.monotonic() < deadline:
+            if seen != feed.version:
+                seen = feed.version
+                items, since = read(since)
+                if items:
+                    yield f'event: {page}\nid: {since}\ndata: {json.dumps(items)}\n\n'
+                    continue
+            if feed.wait(seen, config.LIVE_HEARTBEAT_SECONDS) == seen:
+                # Comments keep proxies from closing the idle stream and notice browsers gone
+                yield ': keepalive\n\n'
+    finally:
+        leave(feed)
@@ -0,0 +1,177 @@
+from contextlib import contextmanager
+import contextvars
+import logging
+import threading
+import time
+import config
+
+logger = logging.getLogger(__name__)
+
+# Upper bounds of latency buckets in seconds
+BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30)
+
+lock = threading.Lock()
+
+# Render labels in prometheus format
+def format_labels(labels):
+    if not labels:
+        return ''
+    return '{' + ','.join('{}="{}"'.format(k, str(v).replace('\\', '\\\\').replace('"', '\\"')) for k, v in labels) + '}'
+
+# Histogram of observations by labels
+class Histogram:
+    def __init__(self, name, help, buckets=BUCKETS):
+        self.name, self.help, self.buckets = name, help, buckets
+        self.series = dict()
+
+    def observe(self, value, **labels):
+        key = tuple(sorted(labels.items()))
+        with lock:
+            series = self.series.setdefault(key, [[0] * len(self.buckets), 0.0, 0])
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    series[0][i] += 1
+            series[1] += value
+            series[2] += 1
+
+    def render(self):
+        lines = [f'# HELP {self.name} {self.help}', f'# TYPE {self.name} histogram']
+        with lock:
+            for key, (counts, total, count) in self.series.items():
+                for bound, n in zip(self.buckets, counts):
+                    lines.append(f'{self.name}_bucket{format_labels(key + (("le", bound),))} {n}')
+                lines.append(f'{self.name}_bucket{format_labels(key + (("le", "+Inf"),))} {count}')
+                lines.append(f'{self.name}_sum{format_labels(key)} {total}')
+                lines.append(f'{self.name}_count{format_labels(key)} {count}')
+        return lines
+
+# Counter or gauge by labels
+class Metric:
+    def __init__(self, name, help, type='counter'):
+        self.name, self.help, self.type = name, help, type
+        self.series = dict()
+
+    def add(self, value=1, **labels):
+        key = tuple(sorted(labels.items()))
+        with lock:
+            self.series[key] = self.series.get(key, 0) + value
+
+    def set(self, value, **labels):
+        key = tuple(sorted(labels.items()))
+        with lock:
+            self.series[key] = value
+
+    def render(self):
+        lines = [f'# HELP {self.name} {self.help}', f'# TYPE {self.name} {self.type}']
+        with lock:
+            for key, value in self.series.items():
+                lines.append(f'{self.name}{format_labels(key)} {value}')
+        return lines
+
+request_seconds = Histogram('akaswap_request_seconds', 'Latency of requests by route')
+phase_seconds = Histogram('akaswap_phase_seconds', 'Latency of request phases by route and phase')
+upstream_seconds = Histogram('akaswap_upstream_seconds', 'Latency of upstream calls by host and endpoint template')
+upstream_calls = Metric('akaswap_upstream_calls_total', 'Upstream calls by host, endpoint template and status')
+upstream_coalesced = Metric('akaswap_upstream_coalesced_total', 'Upstream calls answered by an identical call in flight by host and endpoint template')
+upstream_fanout = Histogram('akaswap_upstream_calls_per_request', 'Upstream calls made by one request by route', buckets=(0, 1, 2, 5, 10, 25, 50, 100, 250, 500, 1000))
+requests_in_flight = Metric('akaswap_requests_in_flight', 'Requests being served', 'gauge')
+upstream_in_flight = Metric('akaswap_upstream_in_flight', 'Upstream calls waiting for a response by host', 'gauge')
+upstream_concurrency = Metric('akaswap_upstream_concurrency_limit', 'Adaptive limit of upstream calls in flight by host', 'gauge')
+upstream_circuit_open = Metric('akaswap_upstream_circuit_open', 'Whether calls to the host fail fast by host', 'gauge')
+live_subscribers = Metric('akaswap_live_subscribers', 'Open live update streams by page', 'gauge')
+live_polls = Metric('akaswap_live_polls_total', 'Polls of live update feeds by page and outcome')
+
+# Caches reported on scrape by name
+caches = dict()
+
+def register_cache(name, cache):
+    caches[name] = cache
+
+def render_caches():
+    lines = []
+    for metric, type in [('hits', 'counter'), ('stale_hits', 'counter'), ('misses', 'counter'), ('evictions', 'counter'), ('size', 'gauge'), ('hit_ratio', 'gauge')]:
+        lines.append(f'# TYPE akaswap_cache_{metric} {type}')
+        for name, cache in caches.items():
+            value = cache.stats()[metric]
+            if value is not None:
+                lines.append(f'akaswap_cache_{metric}{format_labels([("cache", name)])} {value}')
+    return lines
+
+# Text of all metrics in prometheus exposition format
+def render():
+    lines = []
+    for metric in [request_seconds, phase_seconds, upstream_seconds, upstream_calls, upstream_coalesced, upstream_fanout, requests_in_flight, upstream_in_flight, upstream_concurrency, upstream_circuit_open, live_subscribers, live_polls]:
+        lines += metric.render()
+    lines += render_caches()
+    return '\n'.join(lines) + '\n'
+
+# Timings of the request being served, shared with the worker threads it fans out to
+class Trace:
+    def __init__(self, route):
+        self.route = route
+        self.start = time.perf_counter()
+        self.phases = dict()
+        self.upstream_calls = 0
+        self.upstream_seconds = 0.0
+        self.lock = threading.Lock()
+
+    def add_phase(self, name, seconds):
+        with self.lock:
+            self.phases[name] = self.phases.get(name, 0.0) + seconds
+
+    def add_upstream(self, seconds):
+        with self.lock:
+            self.upstream_calls += 1
+            self.upstream_seconds += seconds
+
+current = contextvars.ContextVar('trace', default=None)
+
+def start_request(route):
+    requests_in_flight.add(1)
+    trace = Trace(route)
+    current.set(trace)
+    return trace
+
+# Record the request and log it when slow
+def finish_request(trace, status):
+    # Streamed responses may be closed outside the context they started in
+    if current.get() is trace:
+        current.set(None)
+    requests_in_flight.add(-1)
+    seconds = time.perf_counter() - trace.start
+    request_seconds.observe(seconds, route=trace.route)
+    upstream_fanout.observe(trace.upstream_calls, route=trace.route)
+    for name, phase in trace.phases.items():
+        phase_seconds.observe(phase, route=trace.route, phase=name)
+    if config.SLOW_REQUEST_SECONDS and seconds >= config.SLOW_REQUEST_SECONDS:
+        breakdown = ', '.join(f'{name}={phase:.3f}s' for name, phase in trace.phases.items())
+        logger.warning('Slow request %s status=%s total=%.3fs upstream_calls=%d upstream=%.3fs %s',
+            trace.route, status, seconds, trace.upstream_calls, trace.upstream_seconds, breakdown)
+
+# Time a phase of the request being served
+@contextmanager
+def phase(name):
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        trace = current.get()
+        if trace is not None:
+            trace.add_phase(name, time.perf_counter() - start)
+
+# Time an upstream call
+@contextmanager
+def upstream_call(host, endpoint):
+    upstream_in_flight.add(1, host=host)
+    start = time.perf_counter()
+    outcome = {'status' : 'error'}
+    try:
+        yield outcome
+    finally:
+        seconds = time.perf_counter() - start
+        upstream_in_flight.add(-1, host=host)
+        upstream_seconds.observe(seconds, host=host, endpoint=endpoint)
+        upstream_calls.add(1, host=host, endpoint=endpoint, status=outcome['status'])
+        trace = current.get()
+        if trace is not None:
+            trace.add_upstream(seconds)
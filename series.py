@@ -0,0 +1,70 @@
+import numpy as np
+
+# Sold prices of a token held as typed columns
+class PriceSeries:
+    def __init__(self, rows):
+        # Rows of epoch seconds, price in mutez and amount
+        self.timestamps = np.fromiter((row[0] for row in rows), dtype=np.int64, count=len(rows))
+        self.prices = np.fromiter((row[1] for row in rows), dtype=np.float64, count=len(rows)) / 1000000
+        self.amounts = np.fromiter((row[2] or 1 for row in rows), dtype=np.int64, count=len(rows))
+
+    def __len__(self):
+        return len(self.prices)
+
+    # Average of all prices up to each trade
+    def running_average(self):
+        return np.round(np.cumsum(self.prices) / np.arange(1, len(self) + 1), 2)
+
+    # Average of the last window prices up to each trade
+    def rolling_average(self, window):
+        total = np.concatenate(([0.0], np.cumsum(self.prices)))
+        ends = np.arange(1, len(self) + 1)
+        starts = np.maximum(ends - window, 0)
+        return np.round((total[ends] - total[starts]) / (ends - starts), 2)
+
+    def percentiles(self, qs=(25, 50, 75)):
+        if not len(self):
+            return {q : None for q in qs}
+        return dict(zip(qs, np.percentile(self.prices, qs).tolist()))
+
+    # Traded xtz over all trades
+    def volume(self):
+        return float(np.dot(self.prices, self.amounts))
+
+    def summary(self):
+        if not len(self):
+            return {'count' : 0, 'mean' : None, 'max' : None, 'min' : None, 'volume' : 0, 'percentiles' : self.percentiles()}
+        return {
+            'count'       : len(self),
+            'mean'        : float(self.prices.mean()),
+            'max'         : float(self.prices.max()),
+            'min'         : float(self.prices.min()),
+            'volume'      : self.volume(),
+            'percentiles' : self.percentiles()
+        }
+
+    def digest_bytes(self):
+        return self.timestamps.tobytes() + self.prices.tobytes()
+
+# Indices of points kept by largest-triangle-three-buckets downsampling
+def lttb(x, y, threshold):
+    n = len(x)
+    if threshold >= n or threshold < 3:
+        return np.arange(n)
+
+    x, y = np.asarray(x, dtype=np.float64), np.asarray(y, dtype=np.float64)
+    # First and last points are kept, the rest is split into threshold - 2 buckets
+    edges = np.linspace(1, n - 1, threshold - 1).astype(np.int64)
+    indices = np.empty(threshold, dtype=np.int64)
+    indices[0], indices[-1] = 0, n - 1
+
+    a = 0
+    for i in range(threshold - 2):
+        start, end = edges[i], edges[i + 1]
+        next_end = edges[i + 2] if i + 2 < len(edges) else n
+        avg_x, avg_y = x[end:next_end].mean(), y[end:next_end].mean()
+        area = np.abs((x[a] - avg_x) * (y[start:end] - y[a]) - (x[a] - x[start:end]) * (avg_y - y[a]))
+        a = start + int(area.argmax())
+        indices[i + 1] = a
+
+    return indices
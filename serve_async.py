@@ -0,0 +1,15 @@
+# Serve the app on gevent, each request and each upstream call runs as a greenlet
+# Sockets, locks and thread pools are patched before anything else is imported
+from gevent import monkey
+monkey.patch_all()
+
+from gevent.pool import Pool
+from gevent.pywsgi import WSGIServer
+import config
+from app import create_app
+
+if __name__ == '__main__':
+    app = create_app()
+    server = WSGIServer((config.ASYNC_HOST, config.ASYNC_PORT), app, spawn=Pool(config.ASYNC_MAX_CONNECTIONS))
+    print(f' * Serving on http://{config.ASYNC_HOST}:{config.ASYNC_PORT}/ with up to {config.ASYNC_MAX_CONNECTIONS} connections')
+    server.serve_forever()
@@ -0,0 +1,48 @@
+from datetime import date, timedelta
+import time
+from cache import TTLCache
+import config
+import metrics
+import store
+import transactions
+import upstream
+
+# Records of an account by day, past days are kept until evicted
+shards = TTLCache(config.SHARD_CACHE_SIZE, disk_path=config.CACHE_DISK_PATH)
+metrics.register_cache('shards', shards)
+
+# UTC+8 days from start to end inclusive, newest first
+def days(start_date, end_date):
+    start, end = date.fromisoformat(start_date), date.fromisoformat(end_date)
+    return [(end - timedelta(days=i)).isoformat() for i in range((end - start).days + 1)]
+
+# Page through records of account within one day
+def load(addr, day):
+    params = {'startTime' : transactions.day_timestamp(day), 'endTime' : transactions.day_timestamp(day, days=1)}
+    records = []
+    for page in upstream.iter_pages('account_records', 'records', config.RECORD_PAGE_SIZE, params=params, cached=False, addr=addr):
+        store.aliases.harvest_records(page)
+        records += page
+    return records
+
+# A day that ended before the settle time never changes
+def settled(day):
+    return transactions.epoch(transactions.day_timestamp(day, days=1)) + config.SHARD_SETTLE_SECONDS <= time.time()
+
+# Records of account within one day, newest first, settled days are cached without expiry
+def shard(addr, day):
+    ttl = float('inf') if settled(day) else upstream.ttls['account_records']
+    return shards.get_or_load(f'{addr}/{day}', lambda: load(addr, day), ttl)
+
+# Reload the days of account that may still change, so readers of the cache see new records
+def refresh(addr):
+    today = transactions.today()
+    for day in days((date.fromisoformat(today) - timedelta(days=1)).isoformat(), today):
+        if not settled(day):
+            shards.set(f'{addr}/{day}', load(addr, day), upstream.ttls['account_records'])
+
+# Records of account from start to end date inclusive, newest first
+# Days are fetched concurrently and yielded in order as soon as they are ready
+def iter_records(addr, start_date, end_date):
+    for records in upstream.stream(lambda day: shard(addr, day), days(start_date, end_date)):
+        yield from records
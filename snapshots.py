@@ -0,0 +1,65 @@
+import logging
+import threading
+import time
+import config
+import upstream
+
+logger = logging.getLogger(__name__)
+
+# In-memory snapshot of a catalog of gachas, auctions or bundles
+class CatalogSnapshot:
+    def __init__(self, type, interval):
+        self.type = type
+        self.limit = 30 if type == 'auction' else 20
+        self.interval = interval
+        self.items = None
+        self.refreshed = None
+        self.lock = threading.Lock()
+        self.loading = threading.Lock()
+        self.thread = None
+
+    # Crawl the whole catalog and swap it in, reporting what changed
+    def refresh(self):
+        reply = upstream.fetch_pages('type_list', f'{self.type}s', self.limit, cached=False, type=self.type)
+        # A failed crawl keeps the previous snapshot
+        if reply.status != 200:
+            raise upstream.UpstreamError('Upstream Unavailable')
+        items = reply.data
+        old = {item[f'{self.type}Id'] : item for item in self.items or []}
+        new = {item[f'{self.type}Id'] : item for item in items}
+        added = len(new.keys() - old.keys())
+        removed = len(old.keys() - new.keys())
+        updated = sum(1 for key in new.keys() & old.keys() if new[key] != old[key])
+        with self.lock:
+            self.items = items
+            self.refreshed = time.time()
+        logger.info('%s snapshot refreshed: %d items, %d added, %d removed, %d updated', self.type, len(items), added, removed, updated)
+
+    def run(self):
+        while True:
+            time.sleep(self.interval)
+            try:
+                with self.loading:
+                    self.refresh()
+            except Exception:
+                logger.warning('%s snapshot refresh failed', self.type, exc_info=True)
+
+    # Start refreshing in background, the first crawl is done by the caller
+    def start(self):
+        with self.lock:
+            if self.thread is not None:
+                return
+            self.thread = threading.Thread(target=self.run, name=f'{self.type}-snapshot', daemon=True)
+            self.thread.start()
+
+    # Items of the snapshot and its age in seconds
+    def get(self):
+        self.start()
+        if self.items is None:
+            with self.loading:
+                if self.items is None:
+                    self.refresh()
+        with self.lock:
+            return self.items, time.time() - self.refreshed
+
+catalogs = {type : CatalogSnapshot(type, config.CATALOG_REFRESH_INTERVAL) for type in ['gacha', 'auction', 'bundle']}
@@ -0,0 +1,51 @@
+import statistics
+from cache import TTLCache
+import config
+import metrics
+import upstream
+
+# Record types of sold tokens
+SOLD_TYPES = {'collect', 'collect_offer'}
+
+# Statistics of a token computed from one fetch of its records
+class TokenStats:
+    __slots__ = ['lowest', 'highest', 'average', 'median', 'trades', 'volume', 'last_trade', 'min_swap']
+
+    def __init__(self, token, records):
+        prices, self.volume, self.last_trade = [], 0, None
+        for record in records:
+            if record['type'] in SOLD_TYPES and record['price'] != None:
+                prices.append(record['price'])
+                self.volume += record['price'] * (record.get('amount') or 1)
+                if self.last_trade is None or record['timestamp'] > self.last_trade:
+                    self.last_trade = record['timestamp']
+
+        self.trades = len(prices)
+        self.lowest = min(prices) if prices else None
+        self.highest = max(prices) if prices else None
+        self.average = statistics.mean(prices) if prices else None
+        self.median = statistics.median(prices) if prices else None
+        self.min_swap = min_swap(token)
+
+# Minimum price of current swaps of token
+def min_swap(token):
+    swaps = token['sale']['swaps'] if token.get('sale') else []
+    return min((swap['xtzPerToken'] for swap in swaps), default=None)
+
+# Statistics of tokens by contract and token id
+memo = TTLCache(config.CACHE_SIZE)
+metrics.register_cache("stats", memo)
+
+# Find statistics of token, records are fetched once per ttl
+def token_stats(token):
+    def load():
+        reply = upstream.fetch('token_records', contract=token['contract'], token_id=token['tokenId'])
+        if reply.status != 200:
+            raise upstream.UpstreamError('Non-existent Records')
+        record_list = reply.data['records']
+        return TokenStats(token, record_list)
+    return memo.get_or_load((token['contract'], token['tokenId']), load, config.STATS_TTL)
+
+# Find statistics of all tokens concurrently, None for tokens whose records failed
+def collect(tokens):
+    return upstream.gather(token_stats, tokens)
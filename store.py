@@ -0,0 +1,190 @@
+from collections import Counter
+import logging
+import threading
+import time
+import config
+import db
+from transactions import epoch
+import upstream
+
+logger = logging.getLogger(__name__)
+
+# Record types of sold tokens
+SOLD_TYPES = ('collect', 'collect_offer')
+
+# Local store of token transaction records
+class RecordStore:
+    def __init__(self, path):
+        self.lock = threading.Lock()
+        self.token_locks = dict()
+        self.connection = db.Connection(
+            path,
+            "PRAGMA journal_mode=WAL",
+            """
+            CREATE TABLE IF NOT EXISTS token_records (
+                contract  TEXT    NOT NULL,
+                token_id  INTEGER NOT NULL,
+                timestamp TEXT    NOT NULL,
+                ts        INTEGER NOT NULL,
+                type      TEXT    NOT NULL,
+                price     INTEGER,
+                amount    INTEGER,
+                from_addr TEXT,
+                to_addr   TEXT
+            )
+            """,
+            "CREATE INDEX IF NOT EXISTS token_records_ts ON token_records (contract, token_id, ts)"
+        )
+
+    @property
+    def db(self):
+        return self.connection.get()
+
+    def token_lock(self, contract, token_id):
+        with self.lock:
+            return self.token_locks.setdefault((contract, token_id), threading.Lock())
+
+    # Timestamp of the newest stored record of token
+    def latest(self, contract, token_id):
+        with self.lock:
+            row = self.db.execute("SELECT MAX(timestamp) FROM token_records WHERE contract = ? AND token_id = ?", (contract, token_id)).fetchone()
+        return row[0]
+
+    # Store the given records that are not stored yet, and return how many were new
+    # Stored records from the oldest given timestamp on are matched field by field, so records fetched again,
+    # by an overlapping sync or an inclusive startTime, are stored once while identical trades are all kept
+    def add(self, contract, token_id, records):
+        rows = [
+            (contract, token_id, record['timestamp'], epoch(record['timestamp']), record['type'], record.get('price'), record.get('amount'), record.get('from'), record.get('to'))
+            for record in records
+        ]
+        if not rows:
+            return 0
+        with self.lock:
+            self.db.execute("BEGIN IMMEDIATE")
+            stored = Counter(tuple(row) for row in self.db.execute(
+                "SELECT timestamp, type, price, amount, from_addr, to_addr FROM token_records WHERE contract = ? AND token_id = ? AND timestamp >= ?",
+                (contract, token_id, min(row[2] for row in rows))
+            ))
+            new_rows = []
+            for row in rows:
+                key = (row[2],) + row[4:]
+                if stored[key]:
+                    stored[key] -= 1
+                else:
+                    new_rows.append(row)
+            self.db.executemany("INSERT INTO token_records VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)", new_rows)
+            self.db.commit()
+        return len(new_rows)
+
+    # Fetch records newer than the stored ones, uncached when polling for new trades
+    # Syncs of a token run one at a time, so concurrent first views fetch its history once
+    def sync(self, contract, token_id, cached=True):
+        with self.token_lock(contract, token_id):
+            since = self.latest(contract, token_id)
+            params = {'startTime' : since} if since else None
+            reply = upstream.fetch('token_records', params=params, cached=cached, contract=contract, token_id=token_id)
+            if reply.status != 200:
+                raise upstream.UpstreamError('Non-existent Records')
+            record_list = reply.data['records']
+            # Records come newest first, older ones are dropped in case startTime is ignored
+            return self.add(contract, token_id, [record for record in reversed(record_list) if since is None or record['timestamp'] >= since])
+
+    # Epoch seconds, prices and amounts of sold records of token in time order
+    def sales(self, contract, token_id):
+        with self.lock:
+            return self.db.execute(
+                "SELECT ts, price, amount FROM token_records WHERE contract = ? AND token_id = ? AND type IN (?, ?) AND price IS NOT NULL ORDER BY ts, rowid",
+                (contract, token_id) + SOLD_TYPES
+            ).fetchall()
+
+# Persistent aliases of addresses, filled from akaSwap responses and batched TzKT lookups
+class AliasStore:
+    def __init__(self, path, ttl):
+        self.ttl = ttl
+        self.lock = threading.Lock()
+        self.known = dict()
+        self.connection = db.Connection(path, "CREATE TABLE IF NOT EXISTS aliases (address TEXT PRIMARY KEY, alias TEXT, updated REAL NOT NULL)")
+
+    @property
+    def db(self):
+        return self.connection.get()
+
+    # Remember aliases of addresses, None means the address has no alias
+    # Aliases known unchanged and refreshed within half their lifetime are not written again
+    def remember(self, aliases):
+        now = time.time()
+        with self.lock:
+            rows = []
+            for addr, alias in aliases.items():
+                entry = self.known.get(addr)
+                if addr and (entry is None or entry[0] != alias or entry[1] + self.ttl / 2 < now):
+                    rows.append((addr, alias, now))
+            if not rows:
+                return
+            for addr, alias, updated in rows:
+                self.known[addr] = (alias, updated)
+            self.db.executemany("REPLACE INTO aliases VALUES (?, ?, ?)", rows)
+            self.db.commit()
+
+    # Remember aliases embedded in tokens
+    def harvest_tokens(self, tokens):
+        aliases = dict()
+        for token in tokens:
+            aliases.update((addr, name) for addr, name in (token.get('ownerAliases') or {}).items() if name)
+        self.remember(aliases)
+
+    # Remember aliases embedded in transaction records
+    def harvest_records(self, records):
+        aliases = dict()
+        for record in records:
+            if record.get('fromAlias'):
+                aliases[record['from']] = record['fromAlias']
+            if record.get('toAlias'):
+                aliases[record['to']] = record['toAlias']
+        self.remember(aliases)
+
+    # Find alias of address in memory or on disk
+    def lookup(self, addr):
+        with self.lock:
+            entry = self.known.get(addr)
+            if entry is None:
+                row = self.db.execute("SELECT alias, updated FROM aliases WHERE address = ?", (addr,)).fetchone()
+                if row is not None:
+                    entry = self.known[addr] = tuple(row)
+        if entry is not None and entry[1] + self.ttl > time.time():
+            return entry
+        return None
+
+    # Find aliases of addresses, unknown ones are looked up on TzKT in batches
+    def resolve_many(self, addrs):
+        aliases, unknown = dict(), []
+        for addr in dict.fromkeys(addrs):
+            entry = self.lookup(addr)
+            if entry is None:
+                unknown.append(addr)
+            else:
+                aliases[addr] = entry[0]
+
+        for i in range(0, len(unknown), 100):
+            batch = unknown[i:i+100]
+            try:
+                reply = upstream.fetch('accounts', params={'address.in' : ','.join(batch), 'select' : 'address,alias', 'limit' : len(batch)})
+            except upstream.UpstreamError:
+                logger.warning('Alias lookup failed', exc_info=True)
+                continue
+            if reply.status != 200:
+                continue
+            found = {account['address'] : account['alias'] for account in reply.data}
+            found = {addr : found.get(addr) for addr in batch}
+            self.remember(found)
+            aliases.update(found)
+
+        return {addr : aliases.get(addr) or addr for addr in addrs}
+
+    # Find alias of address, or the address itself
+    def resolve(self, addr):
+        return self.resolve_many([addr])[addr]
+
+records = RecordStore(config.RECORD_STORE_PATH)
+aliases = AliasStore(config.RECORD_STORE_PATH, config.ALIAS_TTL)
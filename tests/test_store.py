@@ -0,0 +1,75 @@
+from concurrent.futures import ThreadPoolExecutor
+import os
+import sys
+import threading
+import time
+import unittest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+os.environ.setdefault('RECORD_STORE_PATH', ':memory:')
+
+import store
+import upstream
+
+CONTRACT = 'KT1AFq5XorPduoYyWxs5gEyrFK6fVjJVbtCj'
+
+def record(day, price, buyer='tz1buyer'):
+    return {'timestamp' : f'2022-01-{day:02d}T00:00:00Z', 'type' : 'collect', 'price' : price, 'amount' : 1, 'from' : 'tz1seller', 'to' : buyer}
+
+# Token records endpoint answering newest first, with startTime inclusive or exclusive
+class Upstream:
+    def __init__(self, records, inclusive=True, delay=0.0):
+        self.records = records
+        self.inclusive = inclusive
+        self.delay = delay
+
+    def fetch(self, name, params=None, cached=True, **path):
+        time.sleep(self.delay)
+        since = (params or {}).get('startTime')
+        kept = [r for r in self.records if since is None or r['timestamp'] > since or (self.inclusive and r['timestamp'] == since)]
+        return upstream.Reply(200, {'records' : list(reversed(kept))})
+
+class RecordStoreTest(unittest.TestCase):
+    def setUp(self):
+        self.records = store.RecordStore(':memory:')
+        self.fetch = upstream.fetch
+
+    def tearDown(self):
+        upstream.fetch = self.fetch
+
+    def sales(self):
+        return self.records.sales(CONTRACT, 1)
+
+    def test_concurrent_first_syncs_store_records_once(self):
+        upstream.fetch = Upstream([record(day, day * 1000000) for day in range(1, 21)], delay=0.01).fetch
+        barrier = threading.Barrier(8)
+
+        def sync(_):
+            barrier.wait()
+            return self.records.sync(CONTRACT, 1)
+
+        with ThreadPoolExecutor(max_workers=8) as executor:
+            added = list(executor.map(sync, range(8)))
+        self.assertEqual(sum(added), 20)
+        self.assertEqual(len(self.sales()), 20)
+
+    def test_boundary_records_survive_either_start_time(self):
+        for inclusive in (True, False):
+            with self.subTest(inclusive=inclusive):
+                self.records = store.RecordStore(':memory:')
+                source = Upstream([record(1, 1000000), record(2, 2000000), record(2, 2000000, 'tz1other')], inclusive)
+                upstream.fetch = source.fetch
+                self.records.sync(CONTRACT, 1)
+                source.records.append(record(3, 3000000))
+                self.assertEqual(self.records.sync(CONTRACT, 1), 1)
+                self.assertEqual(self.records.sync(CONTRACT, 1), 0)
+                self.assertEqual([price for ts, price, amount in self.sales()], [1000000, 2000000, 2000000, 3000000])
+
+    def test_identical_trades_are_all_kept(self):
+        upstream.fetch = Upstream([record(1, 1000000), record(1, 1000000)]).fetch
+        self.records.sync(CONTRACT, 1)
+        self.records.sync(CONTRACT, 1)
+        self.assertEqual(len(self.sales()), 2)
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,152 @@
+from email.utils import parsedate_to_datetime
+import logging
+import threading
+import time
+import config
+import metrics
+
+logger = logging.getLogger(__name__)
+
+# Statuses telling that the host is overloaded
+OVERLOAD_STATUSES = {429, 500, 502, 503, 504}
+
+# Error raised without calling a host whose circuit is open
+class CircuitOpen(Exception):
+    def __init__(self, host, retry_in):
+        self.host = host
+        self.retry_in = retry_in
+
+# Seconds to wait from a Retry-After header, given as seconds or as a date
+def retry_after(value):
+    if not value:
+        return None
+    try:
+        return max(float(value), 0)
+    except ValueError:
+        pass
+    try:
+        return max(parsedate_to_datetime(value).timestamp() - time.time(), 0)
+    except (TypeError, ValueError):
+        return None
+
+# Requests per second with bursts, paused while the host asks to retry later, a rate of 0 is unlimited
+class TokenBucket:
+    def __init__(self, rate, burst):
+        self.rate = rate
+        self.burst = burst
+        self.tokens = burst
+        self.updated = time.monotonic()
+        self.paused_until = 0
+        self.lock = threading.Lock()
+
+    def acquire(self):
+        while True:
+            with self.lock:
+                now = time.monotonic()
+                if now < self.paused_until:
+                    wait = self.paused_until - now
+                elif not self.rate:
+                    return
+                else:
+                    self.tokens = min(self.burst, self.tokens + (now - self.updated) * self.rate)
+                    self.updated = now
+                    if self.tokens >= 1:
+                        self.tokens -= 1
+                        return
+                    wait = (1 - self.tokens) / self.rate
+            time.sleep(wait)
+
+    def pause(self, seconds):
+        with self.lock:
+            self.paused_until = max(self.paused_until, time.monotonic() + seconds)
+
+# Requests in flight, raised by one per limit of successes and halved on overload
+class AdaptiveLimit:
+    def __init__(self, minimum, maximum):
+        self.minimum = minimum
+        self.maximum = maximum
+        self.limit = float(maximum)
+        self.inflight = 0
+        self.condition = threading.Condition()
+
+    def acquire(self):
+        with self.condition:
+            while self.inflight >= int(self.limit):
+                self.condition.wait()
+            self.inflight += 1
+
+    def release(self, overloaded):
+        with self.condition:
+            self.inflight -= 1
+            if overloaded:
+                self.limit = max(self.minimum, self.limit / 2)
+            else:
+                self.limit = min(self.maximum, self.limit + 1 / self.limit)
+            self.condition.notify_all()
+
+# Circuit opened by consecutive failures, a single probe is let through after the cooldown
+class CircuitBreaker:
+    def __init__(self, threshold, cooldown):
+        self.threshold = threshold
+        self.cooldown = cooldown
+        self.failures = 0
+        self.opened = None
+        self.probing = False
+        self.lock = threading.Lock()
+
+    def allow(self):
+        with self.lock:
+            if self.opened is None:
+                return 0
+            retry_in = self.opened + self.cooldown - time.monotonic()
+            if retry_in > 0 or self.probing:
+                return max(retry_in, 0) or self.cooldown
+            self.probing = True
+            return 0
+
+    def record(self, failed):
+        with self.lock:
+            self.probing = False
+            if not failed:
+                self.failures, self.opened = 0, None
+                return False
+            self.failures += 1
+            if self.failures >= self.threshold or self.opened is not None:
+                reopened = self.opened is None
+                self.opened = time.monotonic()
+                return reopened
+            return False
+
+    @property
+    def state(self):
+        return 'closed' if self.opened is None else ('half_open' if self.probing else 'open')
+
+# Rate, concurrency and health of one upstream host
+class HostGuard:
+    def __init__(self, host):
+        self.host = host
+        self.bucket = TokenBucket(config.UPSTREAM_RATE, config.UPSTREAM_BURST)
+        self.limit = AdaptiveLimit(config.UPSTREAM_MIN_CONCURRENCY, config.UPSTREAM_MAX_INFLIGHT)
+        self.circuit = CircuitBreaker(config.CIRCUIT_THRESHOLD, config.CIRCUIT_COOLDOWN)
+
+    # Wait for a request slot, or fail fast while the circuit is open
+    def acquire(self):
+        retry_in = self.circuit.allow()
+        if retry_in:
+            raise CircuitOpen(self.host, retry_in)
+        self.bucket.acquire()
+        self.limit.acquire()
+
+    # Adapt to the outcome of a request, status is None when no response came back
+    def release(self, status=None, headers=None):
+        overloaded = status is None or status in OVERLOAD_STATUSES
+        self.limit.release(overloaded)
+        if status in (429, 503):
+            wait = retry_after((headers or {}).get('Retry-After'))
+            if wait:
+                self.bucket.pause(min(wait, config.CIRCUIT_COOLDOWN))
+        # Throttling is not a failure of the host, errors and missing responses are
+        if self.circuit.record(status is None or status >= 500):
+            logger.warning('Circuit of %s opened for %ss', self.host, self.circuit.cooldown)
+        metrics.upstream_concurrency.set(self.limit.limit, host=self.host)
+        metrics.upstream_circuit_open.set(int(self.circuit.opened is not None), host=self.host)
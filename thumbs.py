@@ -0,0 +1,233 @@
+from concurrent.futures import ThreadPoolExecutor
+import hashlib
+import io
+import logging
+import os
+import re
+import threading
+import time
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+from cache import SingleFlight, TTLCache
+import config
+
+logger = logging.getLogger(__name__)
+
+# Resizing needs Pillow, without it browsers are sent to the gateway rather than proxying originals
+try:
+    from PIL import Image
+except ImportError:
+    Image = None
+
+# Name of thumbnail size to longest side in pixels
+sizes = {
+    'small' : config.THUMB_SIZE,
+    'large' : config.THUMB_LARGE_SIZE
+}
+
+# Extension of cached file to content type
+content_types = {
+    'jpg'  : 'image/jpeg',
+    'png'  : 'image/png',
+    'gif'  : 'image/gif',
+    'webp' : 'image/webp',
+    'svg'  : 'image/svg+xml'
+}
+
+# CID optionally followed by a path inside it
+CID_PATTERN = re.compile(r'^[A-Za-z0-9]{20,100}(/[\w.\-]+)*$')
+
+# Error
+class ThumbError(Exception):
+    def __init__(self, msg):
+        self.msg = msg
+
+# Path after ipfs:// of a display uri, None for uris outside ipfs
+def cid_of(uri):
+    if not uri or not uri.startswith('ipfs://'):
+        return None
+    cid = uri[len('ipfs://'):]
+    return cid if CID_PATTERN.match(cid) else None
+
+# Url of the thumbnail of a display uri, other uris are returned as they are
+def thumb_url(uri, size='small'):
+    cid = cid_of(uri)
+    if cid is None:
+        return uri
+    return f'/thumb/{cid}' if size == 'small' else f'/thumb/{cid}?size={size}'
+
+# Url of the original on the gateway
+def gateway_url(cid):
+    return f'{config.IPFS_GATEWAY}/{cid}'
+
+def new_session():
+    retry = Retry(total=config.UPSTREAM_RETRIES, backoff_factor=config.UPSTREAM_BACKOFF, status_forcelist=[500, 502, 503, 504], raise_on_status=False)
+    adapter = HTTPAdapter(pool_connections=1, pool_maxsize=config.THUMB_CONCURRENCY, max_retries=retry)
+    session = requests.Session()
+    session.mount('http://', adapter)
+    session.mount('https://', adapter)
+    return session
+
+# Size bounded directory of thumbnails, least recently served are removed first
+# Keys are digests of cid and size, and a cid never changes, so files are never refreshed
+class ThumbCache:
+    def __init__(self, path, max_bytes):
+        self.path = path
+        self.max_bytes = max_bytes
+        self.lock = threading.Lock()
+        self.total = None
+
+    def key(self, cid, size):
+        return hashlib.sha256(f'{cid}@{size}'.encode()).hexdigest()
+
+    def files(self):
+        for root, dirs, names in os.walk(self.path):
+            for name in names:
+                yield os.path.join(root, name)
+
+    # Cached file of key and its content type
+    def lookup(self, key):
+        folder = os.path.join(self.path, key[:2])
+        for ext, content_type in content_types.items():
+            file = os.path.join(folder, f'{key}.{ext}')
+            try:
+                # Serving a file marks it as recently used
+                os.utime(file)
+                with open(file, 'rb') as f:
+                    return f.read(), content_type
+            except FileNotFoundError:
+                continue
+        return None
+
+    def store(self, key, data, ext):
+        folder = os.path.join(self.path, key[:2])
+        os.makedirs(folder, exist_ok=True)
+        file = os.path.join(folder, f'{key}.{ext}')
+        # Written aside and renamed so readers never see a partial file
+        temp = f'{file}.{os.getpid()}.{threading.get_ident()}.tmp'
+        with open(temp, 'wb') as f:
+            f.write(data)
+        os.replace(temp, file)
+        with self.lock:
+            if self.total is None:
+                self.total = sum(os.path.getsize(name) for name in self.files())
+            else:
+                self.total += len(data)
+            if self.total > self.max_bytes:
+                self.evict()
+
+    # Remove least recently served files until a tenth of the budget is free
+    def evict(self):
+        entries = []
+        for name in self.files():
+            try:
+                stat = os.stat(name)
+            except FileNotFoundError:
+                continue
+            entries.append((stat.st_mtime, stat.st_size, name))
+        entries.sort()
+        self.total = sum(size for _, size, _ in entries)
+        for mtime, size, name in entries:
+            if self.total <= self.max_bytes * 0.9:
+                break
+            try:
+                os.remove(name)
+            except FileNotFoundError:
+                pass
+            self.total -= size
+
+# Resize image to fit size, keeping transparency as png and everything else as jpeg
+# Images Pillow cannot read, like svg, are kept as they are when small enough
+def resize(data, size, content_type):
+    ext = next((ext for ext, known in content_types.items() if known == content_type), None)
+    try:
+        image = Image.open(io.BytesIO(data))
+        # Animated images keep their first frame
+        image.seek(0)
+        image.thumbnail((size, size))
+    except Exception:
+        if ext is None:
+            raise ThumbError('Not An Image')
+        return data, ext
+    out = io.BytesIO()
+    if image.mode in ('RGBA', 'LA') or (image.mode == 'P' and 'transparency' in image.info):
+        image.convert('RGBA').save(out, 'PNG', optimize=True)
+        return out.getvalue(), 'png'
+    image.convert('RGB').save(out, 'JPEG', quality=config.THUMB_QUALITY, optimize=True)
+    return out.getvalue(), 'jpg'
+
+cache = ThumbCache(config.THUMB_CACHE_DIR, config.THUMB_CACHE_BYTES)
+session = new_session()
+flights = SingleFlight()
+# Errors of thumbnails failing lately by key, so the gateway is not asked again for every page view
+failures = TTLCache(4096)
+# Limit of downloads from the gateway in flight
+slots = threading.BoundedSemaphore(config.THUMB_CONCURRENCY)
+# Workers warming thumbnails of pages before browsers ask for them, each cid is queued once at a time
+prefetcher = ThreadPoolExecutor(max_workers=config.THUMB_CONCURRENCY, thread_name_prefix='thumb-prefetch')
+queued = set()
+queue_lock = threading.Lock()
+
+# Download the original and resize it
+def load(cid, size):
+    with slots:
+        try:
+            r = session.get(gateway_url(cid), timeout=(config.UPSTREAM_CONNECT_TIMEOUT, config.THUMB_READ_TIMEOUT), stream=True)
+        except requests.RequestException:
+            raise ThumbError('Gateway Unavailable')
+        with r:
+            if r.status_code != 200:
+                raise ThumbError(f'Gateway Error {r.status_code}')
+            data = b''
+            for chunk in r.iter_content(65536):
+                data += chunk
+                if len(data) > config.THUMB_MAX_SOURCE_BYTES:
+                    raise ThumbError('Original Too Large')
+            content_type = r.headers.get('Content-Type', '').split(';')[0].strip()
+    return resize(data, size, content_type)
+
+# Thumbnail of cid and its content type, downloaded once however many callers miss it together
+def thumbnail(cid, size):
+    if Image is None:
+        raise ThumbError('Resizing Unavailable')
+    key = cache.key(cid, size)
+    found = cache.lookup(key)
+    if found is not None:
+        return found
+    failure = failures.lookup(key)
+    if failure is not None and failure.expires > time.time():
+        raise ThumbError(failure.value)
+
+    def fetch():
+        try:
+            data, ext = load(cid, size)
+        except ThumbError as e:
+            failures.set(key, e.msg, config.THUMB_RETRY_SECONDS)
+            raise
+        cache.store(key, data, ext)
+        return data, content_types[ext]
+
+    thumb, shared = flights.do(key, fetch)
+    return thumb
+
+# Warm thumbnails of display uris in background
+def prefetch(uris, size='small'):
+    if Image is None:
+        return
+    with queue_lock:
+        jobs = {(cid, sizes[size]) for cid in map(cid_of, uris) if cid is not None} - queued
+        queued.update(jobs)
+    for cid, pixels in jobs:
+        prefetcher.submit(warm, cid, pixels)
+
+def warm(cid, size):
+    try:
+        thumbnail(cid, size)
+    except ThumbError as e:
+        logger.info('Prefetching thumbnail of %s failed: %s', cid, e.msg)
+    except Exception:
+        logger.warning('Prefetching thumbnail of %s failed', cid, exc_info=True)
+    finally:
+        with queue_lock:
+            queued.discard((cid, size))
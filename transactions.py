@@ -0,0 +1,58 @@
+from datetime import datetime, timedelta, timezone
+
+# Times are displayed in UTC+8
+LOCAL = timezone(timedelta(hours=8), 'UTC+8')
+OFFSET = LOCAL.utcoffset(None)
+
+# Parse upstream timestamp like 2021-10-10T12:34:56Z into local time
+def parse_time(timestamp):
+    return (datetime.fromisoformat(timestamp[:19]) + OFFSET).replace(tzinfo=LOCAL)
+
+# Transform upstream timestamp to epoch seconds
+def epoch(timestamp):
+    return int(datetime.fromisoformat(timestamp[:19]).replace(tzinfo=timezone.utc).timestamp())
+
+# Format local time as 2021-10-10 20:34:56
+def display_time(time):
+    return time.isoformat(' ', 'seconds')[:19]
+
+# Upstream timestamp of local midnight of a date like 2021-10-10, shifted by days
+def day_timestamp(date, days=0):
+    return (datetime.fromisoformat(date) - OFFSET + timedelta(days=days)).strftime("%Y-%m-%dT%H:%M:%SZ")
+
+# Local date of today like 2021-10-10
+def today():
+    return datetime.now(LOCAL).date().isoformat()
+
+# Upstream timestamp of now
+def now_timestamp():
+    return datetime.now(timezone.utc).strftime("%Y-%m-%dT%H:%M:%SZ")
+
+# Transaction record holding only the fields the app reads
+class Record:
+    __slots__ = ['timestamp', 'type', 'price', 'amount', 'sender', 'receiver', 'sender_alias', 'receiver_alias', 'contract', 'token_id', 'token_name']
+
+    def __init__(self, timestamp, type, price, amount, sender, receiver, sender_alias, receiver_alias, contract, token_id, token_name):
+        self.timestamp = timestamp
+        self.type = type
+        self.price = price
+        self.amount = amount
+        self.sender = sender
+        self.receiver = receiver
+        self.sender_alias = sender_alias
+        self.receiver_alias = receiver_alias
+        self.contract = contract
+        self.token_id = token_id
+        self.token_name = token_name
+
+    @property
+    def time(self):
+        return parse_time(self.timestamp)
+
+# Decode upstream record
+def decode(record):
+    get = record.get
+    return Record(
+        record['timestamp'], record['type'], get('price'), get('amount'), get('from'), get('to'),
+        get('fromAlias'), get('toAlias'), get('contract'), get('tokenId'), get('tokenName')
+    )
@@ -0,0 +1,240 @@
+from collections import deque, namedtuple
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from itertools import islice
+import contextvars
+import copy
+import logging
+import threading
+import time
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+from cache import SingleFlight, TTLCache
+import config
+import metrics
+import throttle
+
+logger = logging.getLogger(__name__)
+
+# Host name to base url
+hosts = {
+    'akaswap' : config.AKASWAP_API,
+    'site'    : config.AKASWAP_SITE,
+    'tzkt'    : config.TZKT_API
+}
+
+# Endpoint name to host and path template
+endpoints = {
+    'accounts'        : ('tzkt',    '/accounts'),
+    'token'           : ('akaswap', '/fa2tokens/{contract}/{token_id}'),
+    'token_records'   : ('site',    '/fa2tokens/{contract}/{token_id}/records'),
+    'account_tokens'  : ('site',    '/accounts/{addr}/{target}s'),
+    'account_records' : ('akaswap', '/accounts/{addr}/records'),
+    'market_records'  : ('akaswap', '/records'),
+    'type_list'       : ('akaswap', '/{type}s')
+}
+
+# Endpoint name to cache ttl in seconds, endpoints without ttl are not cached
+ttls = {
+    'token'           : config.env('CACHE_TTL_TOKEN', 300, int),
+    'token_records'   : config.env('CACHE_TTL_TOKEN_RECORDS', 60, int),
+    'account_tokens'  : config.env('CACHE_TTL_ACCOUNT_TOKENS', 300, int),
+    'account_records' : config.env('CACHE_TTL_ACCOUNT_RECORDS', 60, int)
+}
+
+# Status and decoded body of a response
+Reply = namedtuple('Reply', ['status', 'data'])
+
+# Error
+class UpstreamError(Exception):
+    def __init__(self, msg):
+        self.msg = msg
+
+# One keep-alive session per host
+# Sessions only retry broken connections, responses are retried by send so the host guard sees every one of them
+def new_session():
+    retry = Retry(
+        total=config.UPSTREAM_RETRIES,
+        backoff_factor=config.UPSTREAM_BACKOFF,
+        status_forcelist=(),
+        respect_retry_after_header=False,
+        raise_on_status=False
+    )
+    adapter = HTTPAdapter(pool_connections=1, pool_maxsize=config.UPSTREAM_POOL_SIZE, max_retries=retry)
+    session = requests.Session()
+    session.mount('http://', adapter)
+    session.mount('https://', adapter)
+    session.headers.update({
+        'Accept'          : 'application/json',
+        'Accept-Encoding' : 'gzip, deflate'
+    })
+    return session
+
+sessions = {host : new_session() for host in hosts}
+
+# Rate, concurrency and circuit of each host
+guards = {host : throttle.HostGuard(host) for host in hosts}
+
+# Global limit of requests in flight
+slots = threading.BoundedSemaphore(config.UPSTREAM_MAX_INFLIGHT)
+
+# Cache of successful responses
+responses = TTLCache(config.CACHE_SIZE, stale_ttl=config.CACHE_STALE_TTL if config.CACHE_STALE else 0, disk_path=config.CACHE_DISK_PATH)
+metrics.register_cache('responses', responses)
+
+# Identical requests in flight
+flights = SingleFlight()
+
+# Build url of endpoint
+def url(name, **path):
+    host, template = endpoints[name]
+    return hosts[host] + template.format(**path)
+
+# Send GET request to endpoint through the guard of its host
+# Throttled and failed requests are retried once the host allows, overloaded hosts raise instead of replying
+def send(name, params=None, **path):
+    host, template = endpoints[name]
+    guard = guards[host]
+    for attempt in range(config.UPSTREAM_RETRIES + 1):
+        try:
+            guard.acquire()
+        except throttle.CircuitOpen:
+            raise UpstreamError('Upstream Unavailable')
+
+        r = None
+        try:
+            with slots, metrics.upstream_call(host, template) as outcome:
+                r = sessions[host].get(url(name, **path), params=params, timeout=(config.UPSTREAM_CONNECT_TIMEOUT, config.UPSTREAM_READ_TIMEOUT))
+                outcome['status'] = r.status_code
+        except requests.RequestException:
+            raise UpstreamError('Upstream Unavailable')
+        finally:
+            guard.release(r.status_code if r is not None else None, r.headers if r is not None else None)
+
+        if r.status_code not in throttle.OVERLOAD_STATUSES:
+            break
+        # Requests the host asked to retry later wait in the guard for that pause, others back off exponentially
+        paused = r.status_code in (429, 503) and throttle.retry_after(r.headers.get('Retry-After'))
+        if not paused and attempt < config.UPSTREAM_RETRIES:
+            time.sleep(config.UPSTREAM_BACKOFF * 2 ** attempt)
+
+    if r.status_code in throttle.OVERLOAD_STATUSES:
+        raise UpstreamError('Upstream Busy')
+    return r
+
+# Send GET request and decode body, concurrent identical requests share one response
+# Every caller decodes the shared body itself so none of them can see another's changes
+def request(name, params=None, **path):
+    r, shared = flights.do(cache_key(name, params, path), lambda: send(name, params, **path))
+    if shared:
+        host, template = endpoints[name]
+        metrics.upstream_coalesced.add(1, host=host, endpoint=template)
+    try:
+        data = r.json()
+    except ValueError:
+        data = None
+    return Reply(r.status_code, data)
+
+# Key of response in cache
+def cache_key(name, params, path):
+    query = '&'.join(f'{k}={v}' for k, v in sorted((params or {}).items()))
+    return f'{url(name, **path)}?{query}'
+
+# Fetch endpoint through the response cache, callers get their own copy of the body
+def fetch(name, params=None, cached=True, loaded=None, **path):
+    # Loaded is called with the body of every successful response fetched from upstream rather than from cache
+    def load():
+        reply = request(name, params, **path)
+        if loaded is not None and reply.status == 200:
+            loaded(reply.data)
+        return reply
+
+    if not cached or not ttls.get(name):
+        return load()
+    reply = responses.get_or_load(
+        cache_key(name, params, path),
+        load,
+        ttls[name],
+        stale=config.CACHE_STALE,
+        fallback=True,
+        cacheable=lambda reply: reply[0] == 200
+    )
+    return Reply(reply[0], copy.deepcopy(reply[1]))
+
+# Apply function to items on a bounded worker pool, keeping order of items
+# Failed items get default, or the first failure is raised when strict
+def gather(fn, items, limit=None, default=None, strict=False):
+    items = list(items)
+    results = [default] * len(items)
+    if not items:
+        return results
+    workers = min(limit or config.UPSTREAM_CONCURRENCY, len(items))
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        # Workers run in a copy of the caller context so their upstream calls count towards its request
+        futures = {executor.submit(contextvars.copy_context().run, fn, item) : i for i, item in enumerate(items)}
+        for future in as_completed(futures):
+            try:
+                results[futures[future]] = future.result()
+            except Exception:
+                if strict:
+                    for pending in futures:
+                        pending.cancel()
+                    raise
+                logger.warning('%s failed on item %d', getattr(fn, '__name__', fn), futures[future], exc_info=True)
+    return results
+
+# Apply function to items on a bounded worker pool, yielding results in order of items as they are ready
+# Items are started no further ahead of the caller than the workers, so results held in memory stay bounded
+def stream(fn, items, limit=None):
+    items = list(items)
+    if not items:
+        return
+    workers = min(limit or config.UPSTREAM_CONCURRENCY, len(items))
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        rest = iter(items)
+        futures = deque(executor.submit(contextvars.copy_context().run, fn, item) for item in islice(rest, workers))
+        try:
+            while futures:
+                result = futures.popleft().result()
+                for item in islice(rest, 1):
+                    futures.append(executor.submit(contextvars.copy_context().run, fn, item))
+                yield result
+        finally:
+            # Items not reached yet are dropped when the caller stops early or an item fails
+            for future in futures:
+                future.cancel()
+
+# Fetch every page of a listing endpoint, pages after the first concurrently
+def fetch_pages(name, key, limit, params=None, cached=True, loaded=None, **path):
+    params = dict(params or {})
+    if loaded is not None:
+        loaded = lambda data, on_items=loaded: on_items(data[key])
+
+    first = fetch(name, params={**params, 'limit' : limit, 'offset' : 0}, cached=cached, loaded=loaded, **path)
+    if first.status != 200 or not first.data['count']:
+        return Reply(first.status, [])
+
+    def page(offset):
+        reply = fetch(name, params={**params, 'limit' : limit, 'offset' : offset}, cached=cached, loaded=loaded, **path)
+        if reply.status != 200:
+            raise UpstreamError('Incomplete Upstream Listing')
+        return reply.data[key]
+
+    items = list(first.data[key])
+    for page_items in gather(page, range(limit, first.data['count'], limit), strict=True):
+        items += page_items
+    return Reply(first.status, items)
+
+# Page through a listing endpoint one page at a time
+def iter_pages(name, key, limit, params=None, cached=True, **path):
+    params, offset = dict(params or {}), 0
+    while True:
+        reply = fetch(name, params={**params, 'limit' : limit, 'offset' : offset}, cached=cached, **path)
+        if reply.status != 200:
+            raise UpstreamError('Incomplete Upstream Listing')
+        items = reply.data[key]
+        yield items
+        offset += len(items)
+        # A short page is the last one, a long one means the endpoint ignored limit
+        if len(items) != limit:
+            break
@@ -0,0 +1,4 @@
+# Entry point of WSGI servers, e.g. gunicorn wsgi:app
+from app import create_app
+
+app = create_app()